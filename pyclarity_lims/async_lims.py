@@ -0,0 +1,410 @@
+"""
+Asynchronous interface to the LIMS, based on asyncio and aiohttp.
+
+This module requires Python 3.6+ and aiohttp which is installed with ``pip install pyclarity_lims[async]``.
+"""
+
+import asyncio
+import base64
+import inspect
+import logging
+from collections import deque
+from functools import partial
+from xml.etree import ElementTree
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .entities import _check_not_async
+from .lims import Lims, BatchError, TIMEOUT, POOL_SIZE, urljoin, _related_entities
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncLims(Lims):
+    """
+    :py:class:`Lims` whose requests are sent with aiohttp so that many of them can be in flight
+    from a single event loop.
+
+    :py:meth:`get`, :py:meth:`put`, :py:meth:`post`, :py:meth:`get_batch`, :py:meth:`put_batch`,
+    :py:meth:`create_batch`, :py:meth:`prefetch_related`, :py:meth:`check_version`, :py:meth:`route_artifacts`
+    and the ``get_*`` list methods are coroutines, the ``iter_*`` methods return asynchronous iterators and
+    :py:meth:`session` is an asynchronous context manager.
+    Entities are loaded with ``await entity.aget()`` or ``await lims.get_batch(entities)``, after which their
+    descriptors are used as with a :py:class:`Lims`. Accessing an entity that was never loaded raises a RuntimeError
+    instead of blocking the event loop, and so do the entity methods that send requests by themselves:
+    ``create``, ``get``, ``Container.get_placements``, ``Step.advance``, ``Step.trigger_program``,
+    ``Step.set_placements`` and ``StepActions.escalation``, as well as the file transfers of the Lims:
+    :py:meth:`get_file_contents`, :py:meth:`iter_file_contents`, :py:meth:`iter_file_lines`,
+    :py:meth:`download_file` and :py:meth:`upload_new_file`. ``put``, ``post``, and ``Process.all_inputs`` and
+    ``all_outputs`` with resolve or prefetch return an awaitable instead.
+
+    The constructor takes the same arguments as :py:class:`Lims`. The aiohttp session is opened on first use and
+    should be closed with :py:meth:`close` or by using the instance as an asynchronous context manager.
+
+    Example: ::
+
+        async with AsyncLims('https://claritylims.example.com', 'username' , 'Pa55w0rd') as lims:
+            artifacts = await lims.get_artifacts(containername='plate1', resolve=True)
+            samples = [a.samples[0] for a in artifacts]
+            await asyncio.gather(*(s.aget() for s in samples))
+
+    """
+
+    is_async = True
+
+    def __init__(self, baseuri, username, password, pool_maxsize=POOL_SIZE, **kwargs):
+        if aiohttp is None:
+            raise ImportError('AsyncLims requires aiohttp: pip install pyclarity_lims[async]')
+        super(AsyncLims, self).__init__(baseuri, username, password, pool_maxsize=pool_maxsize, **kwargs)
+        self.pool_maxsize = pool_maxsize
+        self._client_session = None
+
+    @property
+    def client_session(self):
+        """The aiohttp session sending every request, created in the running event loop on first use."""
+        if self._client_session is None or self._client_session.closed:
+            credentials = ('%s:%s' % (self.username, self.password)).encode('utf-8')
+            self._client_session = aiohttp.ClientSession(
+                headers={'Authorization': 'Basic ' + base64.b64encode(credentials).decode('ascii')},
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize)
+            )
+        return self._client_session
+
+    async def close(self):
+        """Close the aiohttp session and its connections."""
+        if self._client_session is not None:
+            await self._client_session.close()
+            self._client_session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def request(self, method, uri, params=None, timeout=None, **kwargs):
+        """
+        Send an HTTP request through the aiohttp session.
+        Connection errors are reported as requests' ConnectionError with the uri that failed.
+
+        :param method: the HTTP verb in lower case (get, put, post, ...)
+        :param uri: the uri to query
+        :param params: dict containing the query parameters, the values can be lists
+        :param timeout: optional total timeout in seconds
+        :param kwargs: extra arguments passed to the session (data, headers, ...)
+
+        :return a response providing the status_code, headers and content used by :py:meth:`validate_response`
+
+        """
+        if params:
+            kwargs['params'] = _query_items(params)
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        try:
+            async with self.client_session.request(method.upper(), uri, **kwargs) as r:
+                return _Response(uri, r.status, r.headers, await r.read())
+        except aiohttp.ClientConnectionError as e:
+            raise requests.exceptions.ConnectionError("{0}, Error trying to reach {1}".format(e, uri))
+
+    async def get(self, uri, params=dict(), validators=None):
+        r = await self.request('get', uri, params=params,
+                               headers=self._get_headers(validators),
+                               timeout=TIMEOUT)
+        return self._parse_get_response(r, validators)
+
+    async def put(self, uri, data, params=dict()):
+        r = await self.request('put', uri, data=data, params=params,
+                               headers={'content-type': 'application/xml',
+                                        'accept': 'application/xml'})
+        return self.parse_response(r)
+
+    async def _put_instance(self, instance, force=False):
+        if not force and not instance.is_dirty():
+            logger.debug('%s was not modified through its descriptors, nothing is sent (use force=True)', instance)
+            return None
+        self._discard_persisted([instance])
+        root = await self.put(instance.uri, self.tostring(ElementTree.ElementTree(instance.root)))
+        instance._dirty = False
+        return root
+
+    async def post(self, uri, data, params=dict()):
+        r = await self.request('post', uri, data=data, params=params,
+                               headers={'content-type': 'application/xml',
+                                        'accept': 'application/xml'})
+        return self.parse_response(r, accept_status_codes=[200, 201, 202])
+
+    async def load(self, instance, force=False):
+        """
+        Get the XML data of the instance if it has never been retrieved or has expired. Used by
+        :py:meth:`Entity.aget <pyclarity_lims.entities.Entity.aget>`.
+
+        :return: the instance
+        """
+        if not force and instance.root is None and self._load_persisted(instance) and not instance.is_stale():
+            return instance
+        if force or instance.is_stale():
+            validators = instance._get_validators()
+            instance._set_retrieved(await self.get(instance.uri, validators=validators), validators)
+        return instance
+
+    async def check_version(self):
+        r = await self.request('get', urljoin(self.baseuri, 'api'))
+        self._check_versions(self.parse_response(r))
+
+    async def route_artifacts(self, artifact_list, workflow_uri=None, stage_uri=None, unassign=False):
+        r = await self.request('post', self.get_uri('route', 'artifacts'),
+                               data=self._routing_xml(artifact_list, workflow_uri, stage_uri, unassign),
+                               headers={'content-type': 'application/xml',
+                                        'accept': 'application/xml'})
+        self.validate_response(r)
+
+    def get_file_contents(self, id=None, uri=None, encoding=None, crlf=False):
+        _check_not_async(self, 'Lims.get_file_contents')
+
+    def iter_file_contents(self, id=None, uri=None, encoding=None, crlf=False, binary=False, chunk_size=None):
+        _check_not_async(self, 'Lims.iter_file_contents')
+
+    def iter_file_lines(self, id=None, uri=None, encoding=None, crlf=False, chunk_size=None):
+        _check_not_async(self, 'Lims.iter_file_lines')
+
+    def download_file(self, file, id=None, uri=None, encoding=None, crlf=False, output_encoding=None,
+                      chunk_size=None):
+        _check_not_async(self, 'Lims.download_file')
+
+    def upload_new_file(self, entity, file_to_upload, filename=None, progress=None, chunk_size=None):
+        _check_not_async(self, 'Lims.upload_new_file')
+
+    async def _iter_pages(self, uri, params, prefetch_pages=None):
+        if prefetch_pages is None:
+            prefetch_pages = self.prefetch_pages
+        root = await self.get(uri, params=params)
+        node = root.find('next-page')
+        if params.get('start-index') is not None or node is None:
+            yield root
+            return
+        if not prefetch_pages:
+            while node is not None:
+                yield root
+                root = await self.get(node.attrib['uri'], params=params)
+                node = root.find('next-page')
+            yield root
+            return
+
+        page_size = self._page_size(node)
+        next_index = page_size
+        window = 1
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < window:
+                    page_params = dict(params)
+                    page_params['start-index'] = next_index
+                    pending.append(asyncio.ensure_future(self.get(uri, params=page_params)))
+                    next_index += page_size
+                yield root
+                root = await pending.popleft()
+                if root.find('next-page') is None:
+                    yield root
+                    return
+                window = min(window * 2, prefetch_pages)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _iter_instances(self, klass, add_info=False, params=dict(), prefetch_pages=None):
+        async for root in self._iter_pages(self.get_uri(klass._URI), params, prefetch_pages=prefetch_pages):
+            for item in self._page_instances(klass, root, add_info):
+                yield item
+
+    async def _get_instances(self, klass, add_info=None, params=dict(), resolve=False):
+        items = [item async for item in self._iter_instances(klass, add_info=bool(add_info), params=params)]
+        results = [instance for instance, info in items] if add_info else items
+        if resolve:
+            await self.get_batch(results)
+        if not add_info:
+            return results
+        return results, [info for instance, info in items]
+
+    async def _retrieve_batch(self, klass, instances):
+        root = await self.post(self.get_uri(klass._URI, 'batch/retrieve'), self._links_xml(klass, instances))
+        return list(root)
+
+    async def _retrieve_each(self, instances):
+        for instance in instances:
+            await self.load(instance, force=True)
+
+    async def _put_each(self, instances):
+        for instance in instances:
+            await self._put_instance(instance)
+
+    def session(self):
+        """
+        Asynchronous context manager saving the entities modified within it when it exits, see :py:meth:`Lims.session`:
+        ``async with lims.session(): ...``
+        """
+        return _AsyncSession(self)
+
+    async def _flush(self, instances):
+        errors = []
+        for klass, klass_instances in self._group_by_class(instances).items():
+            if klass._SUPPORTS_BATCH:
+                results, klass_errors = await self._map_chunks(partial(self._post_details, klass, 'batch/update'),
+                                                               klass_instances)
+                self._load_updated(results)
+            else:
+                results, klass_errors = await self._map_chunks(self._put_each, klass_instances, batch_size=1)
+            errors.extend(klass_errors)
+        if errors:
+            raise BatchError(errors)
+
+    async def _count_instances(self, klass, params=dict()):
+        uri = self.get_uri(klass._URI)
+        probes = self._count_probes(klass, params)
+        step = next(probes)
+        while isinstance(step, dict):
+            step = probes.send(await self.get(uri, params=step))
+        return step
+
+    async def get_batch(self, instances, force=False, batch_size=None):
+        """
+        Get the content of a set of instances using the efficient batch call, see :py:meth:`Lims.get_batch`.
+        The instances can also be an awaitable returning them such as ``lims.get_artifacts()``.
+        """
+        if inspect.isawaitable(instances):
+            instances = await instances
+        if not instances:
+            return []
+        instance_map, to_retrieve = self._group_batch(instances, force)
+        errors = []
+        for klass, klass_instances in to_retrieve.items():
+            if klass._SUPPORTS_BATCH:
+                results, klass_errors = await self._map_chunks(partial(self._retrieve_batch, klass),
+                                                               klass_instances, batch_size)
+                for chunk, nodes in results:
+                    self._load_nodes(chunk, nodes)
+            else:
+                results, klass_errors = await self._map_chunks(self._retrieve_each, klass_instances, batch_size=1)
+            errors.extend(klass_errors)
+        if errors:
+            raise BatchError(errors)
+        return list(instance_map.values())
+
+    async def put_batch(self, instances, batch_size=None, force=False):
+        instances = self._to_update(instances, force)
+        if not instances:
+            return
+        errors = []
+        for klass, klass_instances in self._group_by_class(instances).items():
+            results, klass_errors = await self._map_chunks(partial(self._post_details, klass, 'batch/update'),
+                                                           klass_instances, batch_size)
+            self._load_updated(results)
+            errors.extend(klass_errors)
+        if errors:
+            raise BatchError(errors)
+
+    async def create_batch(self, klass, kwargs_list, batch_size=None):
+        instances = [klass._create(self, **kwargs) for kwargs in kwargs_list]
+        if not instances:
+            return []
+        results, errors = await self._map_chunks(partial(self._post_details, klass, 'batch/create'),
+                                                 instances, batch_size)
+        created = self._register_created(results)
+        try:
+            await self.get_batch(created)
+        except BatchError as e:
+            raise BatchError(errors, created=created, retrieve_errors=e.errors)
+        if errors:
+            raise BatchError(errors, created=created)
+        return instances
+
+    async def get_containers(self, name=None, type=None, state=None, last_modified=None, udf=dict(), udtname=None,
+                             udt=dict(), start_index=None, add_info=False, resolve=False, prefetch=None):
+        """Get a list of containers, filtered by keyword arguments, see :py:meth:`Lims.get_containers`."""
+        instances = await Lims.get_containers(self, name=name, type=type, state=state, last_modified=last_modified,
+                                              udf=udf, udtname=udtname, udt=udt, start_index=start_index,
+                                              add_info=add_info, resolve=resolve)
+        if prefetch:
+            await self.prefetch_related(instances[0] if add_info else instances, prefetch)
+        return instances
+
+    async def prefetch_related(self, instances, paths):
+        """
+        Retrieve the instances and the entities they reference along the provided attribute paths,
+        see :py:meth:`Lims.prefetch_related`. The instances can also be an awaitable returning them.
+        """
+        if inspect.isawaitable(instances):
+            instances = await instances
+        await self.get_batch(instances)
+        await self._prefetch_tree(instances, self._path_tree(paths))
+        return instances
+
+    async def _prefetch_tree(self, instances, tree):
+        for attribute, subtree in tree.items():
+            related = _related_entities(instances, attribute)
+            await self.get_batch(related)
+            await self._prefetch_tree(related, subtree)
+
+    async def _map_chunks(self, function, items, batch_size=None):
+        """
+        Split the items in chunks of batch_size and await the function on each of them,
+        with up to Lims.max_workers chunks in flight.
+
+        :return: a tuple of two lists: (chunk, result) for the chunks that succeeded in the original order and
+                 (chunk, exception) for the chunks that failed.
+        """
+        chunks = self._split_chunks(items, batch_size)
+        semaphore = asyncio.Semaphore(max(self.max_workers, 1))
+
+        async def call(chunk):
+            async with semaphore:
+                return await function(chunk)
+
+        outcomes = await asyncio.gather(*[call(chunk) for chunk in chunks], return_exceptions=True)
+        results = [(chunk, value) for chunk, value in zip(chunks, outcomes) if not isinstance(value, Exception)]
+        errors = [(chunk, value) for chunk, value in zip(chunks, outcomes) if isinstance(value, Exception)]
+        return results, errors
+
+
+class _AsyncSession(object):
+    """The asynchronous context manager returned by :py:meth:`AsyncLims.session`."""
+
+    def __init__(self, lims):
+        self.lims = lims
+
+    async def __aenter__(self):
+        self.lims._sessions += 1
+        return self.lims
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        modified = self.lims._close_session()
+        if exc_type is None and modified:
+            await self.lims._flush(modified)
+
+
+class _Response(object):
+    """The parts of a requests' Response used by :py:meth:`Lims.validate_response` and :py:meth:`Lims.get`."""
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError('%s Error for url: %s' % (self.status_code, self.url), response=self)
+
+
+def _query_items(params):
+    """Convert query parameters to the list of pairs expected by aiohttp, repeating the keys with a list value."""
+    items = []
+    for key, value in params.items():
+        for v in value if isinstance(value, (list, tuple)) else [value]:
+            if v is not None:
+                items.append((key, str(v)))
+    return items
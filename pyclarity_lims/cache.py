@@ -0,0 +1,258 @@
+"""Caches holding the entities retrieved through a Lims instance."""
+
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+from pyclarity_lims.entities import Containertype, Processtype, Protocol, ProtocolStep, ReagentType, Stage, \
+    Udfconfig, Workflow
+
+# Configuration entities rarely change so they are kept on disk for a day by default
+DEFAULT_EXPIRY = dict((klass, 24 * 3600) for klass in (Containertype, Processtype, Protocol, ProtocolStep,
+                                                       ReagentType, Stage, Udfconfig, Workflow))
+
+
+def xml_size(root):
+    """Return the approximate size in bytes of the XML document under the provided element."""
+    if root is None:
+        return 0
+    size = 0
+    for elem in root.iter():
+        # opening and closing tags
+        size += 2 * len(elem.tag) + 5
+        if elem.text:
+            size += len(elem.text)
+        if elem.tail:
+            size += len(elem.tail)
+        for key, value in elem.attrib.items():
+            size += len(key) + len(value) + 4
+    return size
+
+
+class EntityCache(MutableMapping):
+    """
+    Identity map of the entities created through a :py:class:`Lims <pyclarity_lims.lims.Lims>`, keyed by uri.
+    It behaves like a dict of the entities that are still alive, whether they are kept by the cache or not.
+
+    The most recently used entities are kept with strong references. When there are more than max_entries of them
+    or when their XML takes more than max_bytes, the least recently used ones are evicted.
+    Every entity is also tracked with a weak reference so that an evicted entity still used elsewhere is returned
+    by subsequent lookups instead of being duplicated.
+
+    :param max_entries: Maximum number of entities kept in the cache. Unlimited if None.
+    :param max_bytes: Maximum approximate size of the XML kept in the cache. Unlimited if None.
+
+    Example: ::
+
+        Lims('https://claritylims.example.com', 'username' , 'Pa55w0rd', cache=EntityCache(max_entries=10000))
+
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+        self._recent = OrderedDict()
+        self._sizes = {}
+        self._live = weakref.WeakValueDictionary()
+        self._lock = threading.RLock()
+
+    def __getitem__(self, uri):
+        with self._lock:
+            entity = self._recent.pop(uri, None)
+            if entity is None:
+                entity = self._live.get(uri)
+            if entity is None:
+                self.misses += 1
+                raise KeyError(uri)
+            self.hits += 1
+            self._keep(uri, entity)
+            return entity
+
+    def __setitem__(self, uri, entity):
+        with self._lock:
+            self._forget(uri)
+            self._live[uri] = entity
+            self._keep(uri, entity)
+
+    def __delitem__(self, uri):
+        with self._lock:
+            if uri not in self._live:
+                raise KeyError(uri)
+            self._forget(uri)
+            del self._live[uri]
+
+    def __contains__(self, uri):
+        return uri in self._live
+
+    def __len__(self):
+        return len(self._live)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._live.keys()))
+
+    def values(self):
+        """Return a list of the entities, without counting hits or marking them as recently used."""
+        with self._lock:
+            return list(self._live.values())
+
+    def items(self):
+        """Return a list of the tuples (uri, entity), without counting hits or marking them as recently used."""
+        with self._lock:
+            return list(self._live.items())
+
+    def get(self, uri, default=None):
+        try:
+            return self[uri]
+        except KeyError:
+            return default
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+            self._sizes.clear()
+            self._live.clear()
+            self.size = 0
+
+    def resize(self, entity):
+        """Record the new size of an entity after its XML was replaced."""
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            uri = entity.uri
+            if self._recent.get(uri) is entity:
+                self.size -= self._sizes.get(uri, 0)
+                self._sizes[uri] = xml_size(entity.root)
+                self.size += self._sizes[uri]
+                self._evict()
+
+    def _keep(self, uri, entity):
+        """Mark the entity as the most recently used one."""
+        self._recent[uri] = entity
+        if self.max_bytes is not None and uri not in self._sizes:
+            self._sizes[uri] = xml_size(entity.root)
+            self.size += self._sizes[uri]
+        self._evict()
+
+    def _forget(self, uri):
+        """Release the strong reference held for the uri."""
+        if self._recent.pop(uri, None) is not None:
+            self.size -= self._sizes.pop(uri, 0)
+
+    def _evict(self):
+        # The most recent entry is always kept even if it is larger than max_bytes on its own
+        while len(self._recent) > 1 and (
+                (self.max_entries is not None and len(self._recent) > self.max_entries) or
+                (self.max_bytes is not None and self.size > self.max_bytes)):
+            uri, entity = self._recent.popitem(last=False)
+            self.size -= self._sizes.pop(uri, 0)
+            self.evictions += 1
+
+
+class PersistentCache(object):
+    """
+    SQLite database storing the XML of the entities retrieved through a :py:class:`Lims <pyclarity_lims.lims.Lims>`
+    so that separate processes, such as successive EPP scripts, do not download it again.
+
+    The XML is stored by uri with the time it was retrieved and its ETag/Last-Modified validators. Only the classes
+    present in expiry are stored and their XML is used until it is older than the expiry. The database can be used
+    by several processes at the same time.
+
+    :param path: Path of the SQLite database file, created if it does not exist.
+    :param expiry: Optional dict of time in seconds after which the XML is retrieved again, keyed by Entity class.
+                   None means that it never expires. By default the configuration entities expire after a day.
+    :param timeout: Number of seconds to wait for another process to release the database.
+
+    Example: ::
+
+        Lims('https://claritylims.example.com', 'username' , 'Pa55w0rd',
+             persistent_cache=PersistentCache('/tmp/clarity_cache.sqlite', expiry={Processtype: 3600}))
+
+    """
+
+    def __init__(self, path, expiry=None, timeout=30):
+        self.path = path
+        self.expiry = DEFAULT_EXPIRY if expiry is None else dict(expiry)
+        self.timeout = timeout
+        # sqlite3 connections cannot be shared between threads
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS entities ('
+                               'uri TEXT PRIMARY KEY, xml BLOB, retrieved_at REAL, etag TEXT, last_modified TEXT)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            # Readers do not block the writer of another process
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def stores(self, klass):
+        """Whether the XML of the provided Entity class is stored."""
+        return any(k in self.expiry for k in klass.__mro__)
+
+    def get_expiry(self, klass):
+        """Return the expiry in seconds of the provided Entity class, or None if it never expires."""
+        for k in klass.__mro__:
+            if k in self.expiry:
+                return self.expiry[k]
+        return None
+
+    def load(self, klass, uri):
+        """
+        Return a tuple (xml, retrieved_at, validators) for the uri or None if it is not stored or has expired.
+
+        :param klass: the Entity class of the uri
+        :param uri: the uri of the entity
+        """
+        if not self.stores(klass):
+            return None
+        row = self._connection().execute(
+            'SELECT xml, retrieved_at, etag, last_modified FROM entities WHERE uri = ?', (uri,)
+        ).fetchone()
+        if row is None:
+            return None
+        xml, retrieved_at, etag, last_modified = row
+        expiry = self.get_expiry(klass)
+        if expiry is not None and time.time() - retrieved_at > expiry:
+            return None
+        validators = {}
+        if etag:
+            validators['ETag'] = etag
+        if last_modified:
+            validators['Last-Modified'] = last_modified
+        return bytes(xml), retrieved_at, validators
+
+    def store(self, entries):
+        """
+        Store the XML of entities.
+
+        :param entries: list of tuples (uri, xml, retrieved_at, validators)
+        """
+        rows = [(uri, sqlite3.Binary(xml), retrieved_at, (validators or {}).get('ETag'),
+                 (validators or {}).get('Last-Modified')) for uri, xml, retrieved_at, validators in entries]
+        if rows:
+            with self._connection() as connection:
+                connection.executemany('INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?)', rows)
+
+    def delete(self, uris):
+        """Remove the XML stored for the uris."""
+        with self._connection() as connection:
+            connection.executemany('DELETE FROM entities WHERE uri = ?', [(uri,) for uri in uris])
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM entities')
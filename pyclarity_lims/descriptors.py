@@ -22,6 +22,27 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def _make_element(parent, tag, **attrib):
+    """Create an element with the XML implementation of the parent, ElementTree or lxml, so it can be added to it."""
+    return parent.makeelement(tag, attrib)
+
+
+def _sub_element(parent, tag, **attrib):
+    """Create an element with the XML implementation of the parent and append it to the parent."""
+    element = parent.makeelement(tag, attrib)
+    parent.append(element)
+    return element
+
+
+def _same_node(node1, node2):
+    """Whether two XML elements have the same tag, attributes, text and sub elements, ignoring the whitespaces."""
+    if node1.tag != node2.tag or node1.attrib != node2.attrib:
+        return False
+    if (node1.text or '').strip() != (node2.text or '').strip() or len(node1) != len(node2):
+        return False
+    return all(_same_node(child1, child2) for child1, child2 in zip(node1, node2))
+
+
 class XmlElement(object):
     """Abstract class providing functionality to access the root node of an instance"""
     def rootnode(self, instance):
@@ -41,8 +62,7 @@ class Nestable(XmlElement):
         for rootkey in self.rootkeys:
             childnode = _rootnode.find(rootkey)
             if childnode is None:
-                childnode = ElementTree.Element(rootkey)
-                _rootnode.append(childnode)
+                childnode = _sub_element(_rootnode, rootkey)
             _rootnode = childnode
         return _rootnode
 
@@ -52,6 +72,10 @@ class XmlMutable(XmlElement):
     def __init__(self, instance):
         self.instance = instance
 
+    def _reload(self):
+        """Parse the XML of the instance again after its root was replaced."""
+        raise NotImplementedError
+
 
 # Dictionary types
 class XmlDictionary(XmlMutable, dict):
@@ -72,14 +96,25 @@ class XmlDictionary(XmlMutable, dict):
         self._delitem(key)
         self._update_elems()
 
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
     def _prepare_lookup(self):
         for elem in self._elems:
             self._parse_element(elem)
 
+    def _reload(self):
+        dict.clear(self)
+        self._update_elems()
+        self._prepare_lookup()
+
     def clear(self):
         dict.clear(self)
         for elem in self._elems:
             self.rootnode(self.instance).remove(elem)
+        if self._elems:
+            self.instance.mark_dirty()
         self._update_elems()
 
     def _update_elems(self):
@@ -96,7 +131,10 @@ class XmlDictionary(XmlMutable, dict):
 
 
 class UdfDictionary(Nestable, XmlDictionary):
-    "Dictionary-like container of UDFs, optionally within a UDT."
+    """
+    Dictionary-like container of UDFs, optionally within a UDT.
+    The XML elements are indexed by name so that setting or deleting a UDF does not scan the other ones.
+    """
 
     def _is_string(self, value):
         try:
@@ -122,22 +160,42 @@ class UdfDictionary(Nestable, XmlDictionary):
         self._udt = name
         elem = self.rootnode(self.instance).find(nsmap('udf:type'))
         assert elem is not None
-        elem.set('name', name)
+        if elem.get('name') != name:
+            elem.set('name', name)
+            self.instance.mark_dirty()
 
     udt = property(get_udt, set_udt)
 
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._setitem(key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._delitem(key)
+
+    def clear(self):
+        dict.clear(self)
+        for elem in self._elems:
+            self._parent.remove(elem)
+        if self._elems:
+            self.instance.mark_dirty()
+        self._update_elems()
+
     def _update_elems(self):
         self._elems = []
         if self._udt:
-            elem = self.rootnode(self.instance).find(nsmap('udf:type'))
-            if elem is not None:
-                self._udt = elem.attrib['name']
-                self._elems = elem.findall(nsmap('udf:field'))
+            self._parent = self.rootnode(self.instance).find(nsmap('udf:type'))
+            if self._parent is not None:
+                self._udt = self._parent.attrib['name']
+                self._elems = self._parent.findall(nsmap('udf:field'))
         else:
             tag = nsmap('udf:field')
-            for elem in list(self.rootnode(self.instance)):
+            self._parent = self.rootnode(self.instance)
+            for elem in list(self._parent):
                 if elem.tag == tag:
                     self._elems.append(elem)
+        self._index = dict((elem.attrib['name'], elem) for elem in self._elems)
 
     def _parse_element(self, element, **kwargs):
         type = element.attrib['type'].lower()
@@ -156,8 +214,8 @@ class UdfDictionary(Nestable, XmlDictionary):
         dict.__setitem__(self, element.attrib['name'], value)
 
     def _setitem(self, key, value):
-        for node in self._elems:
-            if node.attrib['name'] != key: continue
+        node = self._index.get(key)
+        if node is not None:
             vtype = node.attrib['type'].lower()
 
             if value is None:
@@ -192,8 +250,9 @@ class UdfDictionary(Nestable, XmlDictionary):
             if not isinstance(value, str):
                 if not self._is_string(value):
                     value = str(value).encode('UTF-8')
-            node.text = value
-            break
+            if node.text != value:
+                node.text = value
+                self.instance.mark_dirty()
         else:  # Create new entry; heuristics for type
             if self._is_string(value):
                 vtype = '\n' in value and 'Text' or 'String'
@@ -209,42 +268,44 @@ class UdfDictionary(Nestable, XmlDictionary):
             else:
                 raise NotImplementedError("Cannot handle value of type '%s'"
                                           " for UDF" % type(value))
-            if self._udt:
-                root = self.rootnode(self.instance).find(nsmap('udf:type'))
-            else:
-                root = self.rootnode(self.instance)
-            elem = ElementTree.SubElement(root,
-                                          nsmap('udf:field'),
-                                          type=vtype,
-                                          name=key)
+            elem = _sub_element(self._parent, nsmap('udf:field'), type=vtype, name=key)
             if not isinstance(value, str):
                 if not self._is_string(value):
                     value = str(value).encode('UTF-8')
 
             elem.text = value
+            self._elems.append(elem)
+            self._index[key] = elem
+            self.instance.mark_dirty()
 
     def _delitem(self, key):
-        for node in self._elems:
-            if node.attrib['name'] == key:
-                self.rootnode(self.instance).remove(node)
-                break
+        node = self._index.pop(key, None)
+        if node is not None:
+            self._parent.remove(node)
+            self._elems.remove(node)
+            self.instance.mark_dirty()
 
 
 class XmlElementAttributeDict(XmlDictionary, Nestable):
     """
     Dictionary of attributes for a specific xml element.
     It will find all the elements with the specified tag and use the one in the provided position
-    then put all attributes of that tag in a dict.
+    then put all attributes of that tag in a dict. The element can also be provided directly, which spares
+    the lists of these dicts from searching all the elements for each of them.
     The key is the attribute's name and value is the attribute's value.
     """
 
     def __init__(self, instance, tag, *args, **kwargs):
         self.position = kwargs.pop('position', 0)
+        self.element = kwargs.pop('element', None)
         self.tag = tag
         Nestable.__init__(self, nesting=kwargs.pop('nesting', []))
         XmlDictionary.__init__(self, instance, *args, **kwargs)
 
     def _update_elems(self):
+        if self.element is not None:
+            self._elems = [self.element]
+            return
         # only one element here
         # find all the tags
         all_tags = self.rootnode(self.instance).findall(self.tag)
@@ -259,10 +320,13 @@ class XmlElementAttributeDict(XmlDictionary, Nestable):
             dict.__setitem__(self, k, v)
 
     def _setitem(self, key, value):
-        self._elems[0].attrib[key] = value
+        if self._elems[0].attrib.get(key) != value:
+            self._elems[0].attrib[key] = value
+            self.instance.mark_dirty()
 
     def _delitem(self, key):
         del self._elems[0].attrib[key]
+        self.instance.mark_dirty()
 
 
 class XmlAction(XmlElementAttributeDict):
@@ -295,22 +359,41 @@ class XmlAction(XmlElementAttributeDict):
             pass
         else:
             raise KeyError('%s Is not a supported key for next action' % key)
-        self._elems[0].attrib[key] = value
+        XmlElementAttributeDict._setitem(self, key, value)
 
     def _delitem(self, key):
         if key in ['artifact', 'step', 'rework-step']:
             key = key + '-uri'
-        del self._elems[0].attrib[key]
+        XmlElementAttributeDict._delitem(self, key)
 
 
 class PlacementDictionary(XmlDictionary):
     """Dictionary of placement in a Container.
     The key is the location such as "A:1"
     and the value is the artifact in that well/tube.
+    The XML elements are indexed by location so that changing a placement does not scan the other ones.
     """
 
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._setitem(key, value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._delitem(key)
+
+    def clear(self):
+        dict.clear(self)
+        if self._elems:
+            rootnode = self.rootnode(self.instance)
+            removed = set(self._elems)
+            rootnode[:] = [child for child in rootnode if child not in removed]
+            self.instance.mark_dirty()
+        self._update_elems()
+
     def _update_elems(self):
         self._elems = self.rootnode(self.instance).findall('placement')
+        self._index = dict((elem.find('value').text, elem) for elem in self._elems)
 
     def _parse_element(self, element, **kwargs):
         from pyclarity_lims.entities import Artifact
@@ -320,22 +403,27 @@ class PlacementDictionary(XmlDictionary):
     def _setitem(self, key, value):
         if not isinstance(key, str):
             raise ValueError()
-        elem1 = None
-        for node in self._elems:
-            if node.find('value').text == key:
-                elem1 = node
-                break
-        if elem1:
-            self.rootnode(self.instance).remove(elem1)
-        elem1 = ElementTree.SubElement(self.rootnode(self.instance), 'placement', uri=value.uri, limsid=value.id)
-        elem2 = ElementTree.SubElement(elem1, 'value')
-        elem2.text = key
+        elem1 = self._index.get(key)
+        if elem1 is not None:
+            if elem1.attrib.get('uri') == value.uri:
+                return
+            # Move the new artifact in the existing placement
+            elem1.attrib['uri'] = value.uri
+            elem1.attrib['limsid'] = value.id
+        else:
+            elem1 = _sub_element(self.rootnode(self.instance), 'placement', uri=value.uri, limsid=value.id)
+            elem2 = _sub_element(elem1, 'value')
+            elem2.text = key
+            self._elems.append(elem1)
+            self._index[key] = elem1
+        self.instance.mark_dirty()
 
     def _delitem(self, key):
-        for node in self._elems:
-            if node.find('value').text == key:
-                self.rootnode(self.instance).remove(node)
-                break
+        node = self._index.pop(key, None)
+        if node is not None:
+            self.rootnode(self.instance).remove(node)
+            self._elems.remove(node)
+            self.instance.mark_dirty()
 
 
 class SubTagDictionary(XmlDictionary, Nestable):
@@ -366,14 +454,18 @@ class SubTagDictionary(XmlDictionary, Nestable):
 
         elem = root_node.find(key)
         if elem is None:
-            elem = ElementTree.SubElement(root_node, key)
+            elem = _sub_element(root_node, key)
+        elif elem.text == value:
+            return
         elem.text = value
+        self.instance.mark_dirty()
 
     def _delitem(self, key):
         root_node = self.rootnode(self.instance)
         for node in self._elems:
             if node.tag == key:
                 root_node.remove(node)
+                self.instance.mark_dirty()
                 break
 
 
@@ -397,18 +489,19 @@ class XmlPooledInputDict(XmlDictionary, Nestable):
             raise TypeError('You need to provide a tuple of 2 elements not ' + type(value))
         pool, list_input = value
         self._delitem(key)
-        node = ElementTree.SubElement(self.rootnode(self.instance), 'pool')
+        node = _sub_element(self.rootnode(self.instance), 'pool')
         node.attrib['name'] = key
         node.attrib['uri'] = pool.uri
         for inart in list_input:
-            sub = ElementTree.Element('input')
+            sub = _sub_element(node, 'input')
             sub.attrib['uri'] = inart.uri
-            node.append(sub)
+        self.instance.mark_dirty()
 
     def _delitem(self, key):
         for node in self._elems:
             if node.attrib['name'] == key:
                 self.rootnode(self.instance).remove(node)
+                self.instance.mark_dirty()
                 break
 
     def _parse_element(self, element, **kwargs):
@@ -425,7 +518,13 @@ class XmlPooledInputDict(XmlDictionary, Nestable):
 
 # List types
 class XmlList(XmlMutable, list):
-    """Class that behave like a list and modify the provided instance as the list gets updated"""
+    """
+    Class that behave like a list and modify the provided instance as the list gets updated.
+    The cached _elems are kept in sync with the list so that appending does not search the XML again.
+    """
+    # Whether the values depend on their position in the list and need updating when items are inserted before them
+    _POSITIONAL = False
+
     def __init__(self, instance, *args, **kwargs):
         XmlMutable.__init__(self, instance=instance)
         list.__init__(self, *args, **kwargs)
@@ -436,29 +535,35 @@ class XmlList(XmlMutable, list):
         for i, elem in enumerate(self._elems):
             self._parse_element(elem, lims=self.instance.lims, position=i)
 
+    def _reload(self):
+        list.__delitem__(self, slice(None))
+        self._update_elems()
+        self._prepare_list()
+
     def clear(self):
         # python 2.7 does not have a clear function for list
         del self[:]
-        for elem in self._elems:
-            self.rootnode(self.instance).remove(elem)
+        if self._elems:
+            rootnode = self.rootnode(self.instance)
+            removed = set(self._elems)
+            rootnode[:] = [child for child in rootnode if child not in removed]
+            self.instance.mark_dirty()
         self._update_elems()
 
     def __add__(self, other_list):
-        for item in other_list:
-            self._additem(item)
-        self._update_elems()
+        other_list = list(other_list)
+        self._additems(other_list)
         return list.__add__(self, [self._modify_value_before_insert(v, len(self) + i) for i, v in enumerate(other_list)])
 
     def __iadd__(self, other_list):
-        for item in other_list:
-            self._additem(item)
-        self._update_elems()
-        return list.__iadd__(self, [self._modify_value_before_insert(v) for i, v in enumerate(other_list)])
+        self.extend(other_list)
+        return self
 
     def __setitem__(self, i, item):
         if isinstance(i, slice):
             new_items = []
             slice_range = range(*i.indices(len(self)))
+            item = list(item)
             if len(slice_range) != len(item):
                 raise ValueError('Setting slice and list of different size is not supported %s != %s' % (len(slice_range), len(item)))
             for k, v in zip(slice_range, item):
@@ -470,48 +575,75 @@ class XmlList(XmlMutable, list):
             item = self._modify_value_before_insert(item, i)
         else:
             raise TypeError('list indices must be integers or slices, not ' + type(i) )
-        self._update_elems()
         return list.__setitem__(self, i, item)
 
     def insert(self, i, item):
+        if i < 0:
+            i = max(len(self) + i, 0)
+        i = min(i, len(self))
         self._insertitem(i, item)
-        self._update_elems()
         return_value = list.insert(self, i, self._modify_value_before_insert(item, i))
-        # Hack to make sure subsequent element get updated if the went trough _modify_value_before_insert
-        new_items = []
-        for p, v in enumerate(self[i + 1:]):
-            new_items.append(self._modify_value_before_insert(v, i + 1 + p))
-        list.__setitem__(self, slice(i + 1, len(self), 1), new_items)
+        if self._POSITIONAL:
+            # Make sure subsequent elements get updated as their position changed
+            new_items = []
+            for p, v in enumerate(self[i + 1:]):
+                new_items.append(self._modify_value_before_insert(v, i + 1 + p))
+            list.__setitem__(self, slice(i + 1, len(self), 1), new_items)
 
     def append(self, item):
         self._additem(item)
-        self._update_elems()
         return list.append(self, self._modify_value_before_insert(item, len(self)))
 
     def extend(self, iterable):
-        for v in iterable:
-            self._additem(v)
-        self._update_elems()
-        return list.extend(self, [self._modify_value_before_insert(v, len(self) + i) for i, v in enumerate(iterable)])
+        values = list(iterable)
+        self._additems(values)
+        return list.extend(self, [self._modify_value_before_insert(v, len(self) + i) for i, v in enumerate(values)])
 
     def _additem(self, value):
-        node = self._create_new_node(value)
-        self.rootnode(self.instance).append(node)
+        self._additems([value])
+
+    def _additems(self, values):
+        """Append the nodes created for the values to the xml and the cached _elems in a single pass."""
+        if not values:
+            return
+        rootnode = self.rootnode(self.instance)
+        for value in values:
+            node = self._create_new_node(value)
+            rootnode.append(node)
+            self._elems.append(node)
+        self.instance.mark_dirty()
 
     def _insertitem(self, index, value):
         node = self._create_new_node(value)
-        self.rootnode(self.instance).insert(index, node)
+        rootnode = self.rootnode(self.instance)
+        if index < len(self._elems):
+            # Insert before the node currently at this index
+            rootnode.insert(list(rootnode).index(self._elems[index]), node)
+        else:
+            rootnode.append(node)
+        self._elems.insert(index, node)
+        self.instance.mark_dirty()
 
     def _setitem(self, index, value):
         node = self._create_new_node(value)
-        # Remove the old value in the xml
-        self._delitem(index)
-        # Insert it in place
-        self.rootnode(self.instance).insert(index, node)
+        old_node = self._elems[index]
+        if _same_node(node, old_node):
+            # Same value: leave the xml untouched
+            return
+        # Replace the content of the old node so that it keeps its place in the xml
+        tail = old_node.tail
+        old_node.clear()
+        old_node.tag = node.tag
+        old_node.text = node.text
+        old_node.tail = tail
+        old_node.attrib.update(node.attrib)
+        old_node.extend(list(node))
+        self.instance.mark_dirty()
 
     def _delitem(self, index):
         # Remove the value in the xml and update the cached _elems
-        self.rootnode(self.instance).remove(self._elems[index])
+        self.rootnode(self.instance).remove(self._elems.pop(index))
+        self.instance.mark_dirty()
 
     def _update_elems(self):
         raise NotImplementedError
@@ -544,7 +676,7 @@ class XmlTextList(TagXmlList):
     The list can only contain string but can be passed any type which will be converted to string"""
 
     def _create_new_node(self, value):
-        node = ElementTree.Element(self.tag)
+        node = _make_element(self.rootnode(self.instance), self.tag)
         node.text = str(value)
         return node
 
@@ -557,33 +689,39 @@ class XmlAttributeList(TagXmlList):
     The list can only contain and be provided with dict.
     The internal dicts are XmlElementAttributeDict which can be modified directly to modify the XML"""
 
+    _POSITIONAL = True
+
     def _create_new_node(self, value):
         if not isinstance(value, dict):
             raise TypeError('You need to provide a dict not ' + type(value))
-        node = ElementTree.Element(self.tag)
+        node = _make_element(self.rootnode(self.instance), self.tag)
         for k, v in value.items():
             node.attrib[k] = v
         return node
 
     def _parse_element(self, element, lims, position, **kwargs):
-        d = XmlElementAttributeDict(self.instance, tag=self.tag, nesting=self.rootkeys, position=position)
+        d = XmlElementAttributeDict(self.instance, tag=self.tag, nesting=self.rootkeys, position=position,
+                                    element=element)
         list.append(self, d)
 
     def _modify_value_before_insert(self, value, position):
         """function called for each value being inserted in the list.
         Give subclass an opportunity to alter the data before insert"""
-        return XmlElementAttributeDict(self.instance, tag=self.tag, nesting=self.rootkeys, position=position)
+        return XmlElementAttributeDict(self.instance, tag=self.tag, nesting=self.rootkeys, position=position,
+                                       element=self._elems[position])
 
 
 class XmlActionList(TagXmlList):
 
+    _POSITIONAL = True
+
     def __init__(self, instance, *args, **kwargs):
         TagXmlList.__init__(self, instance, tag='next-action', nesting=['next-actions'], *args, **kwargs)
 
     def _create_new_node(self, value):
         if not isinstance(value, dict):
             raise TypeError('You need to provide a dict not ' + type(value))
-        node = ElementTree.Element(self.tag)
+        node = _make_element(self.rootnode(self.instance), self.tag)
         for k, v in value.items():
             if k in ['artifact', 'step', 'rework-step']:
                 k = k + '-uri'
@@ -592,18 +730,21 @@ class XmlActionList(TagXmlList):
         return node
 
     def _parse_element(self, element, lims, position, **kwargs):
-        d = XmlAction(self.instance, tag=self.tag, nesting=self.rootkeys, position=position)
+        d = XmlAction(self.instance, tag=self.tag, nesting=self.rootkeys, position=position, element=element)
         list.append(self, d)
 
     def _modify_value_before_insert(self, value, position):
         """function called for each value being inserted in the list.
         Give subclass an opportunity to alter the data before insert"""
-        return XmlAction(self.instance, tag=self.tag, nesting=self.rootkeys, position=position)
+        return XmlAction(self.instance, tag=self.tag, nesting=self.rootkeys, position=position,
+                         element=self._elems[position])
 
 
 class XmlReagentLabelList(XmlAttributeList):
     """This is a list of reagent label."""
 
+    _POSITIONAL = False
+
     def __init__(self, instance, nesting=None, *args, **kwargs):
         XmlAttributeList.__init__(self, instance, tag='reagent-label', nesting=nesting, *args, **kwargs)
 
@@ -627,7 +768,7 @@ class EntityList(TagXmlList):
     def _create_new_node(self, value):
         if not isinstance(value, self.klass):
             raise TypeError('You need to provide an %s not %s' % (self.klass, type(value)))
-        node = ElementTree.Element(self.tag)
+        node = _make_element(self.rootnode(self.instance), self.tag)
         node.attrib['uri'] = value.uri
         return node
 
@@ -685,11 +826,11 @@ class OutputPlacementList(TagXmlList):
             raise TypeError('You need to provide a tuple not %s' % (type(value)))
         art, location = value
         container, position = location
-        node = ElementTree.Element(self.tag)
+        node = _make_element(self.rootnode(self.instance), self.tag)
         node.attrib['uri'] = art.uri
-        elem = ElementTree.SubElement(node, 'location')
-        ElementTree.SubElement(elem, 'container', uri=container.uri, limsid=container.id)
-        v = ElementTree.SubElement(elem, 'value')
+        elem = _sub_element(node, 'location')
+        _sub_element(elem, 'container', uri=container.uri, limsid=container.id)
+        v = _sub_element(elem, 'value')
         v.text = position
         return node
 
@@ -714,7 +855,7 @@ class ExternalidList(XmlList):
     def _create_new_node(self, value):
         if not isinstance(value, tuple):
             raise TypeError('You need to provide a tuple not ' + type(value))
-        node = ElementTree.Element(nsmap('ri:externalid'))
+        node = _make_element(self.rootnode(self.instance), nsmap('ri:externalid'))
         id, uri = value
         node.attrib['id'] = id
         node.attrib['uri'] = uri
@@ -808,12 +949,15 @@ class StringDescriptor(TagDescriptor):
 
     def __set__(self, instance, value):
         instance.get()
+        value = str(value)
         node = self.get_node(instance)
         if node is None:
             # create the new tag
-            node = ElementTree.Element(self.tag)
-            self.rootnode(instance).append(node)
-        node.text = str(value)
+            node = _sub_element(self.rootnode(instance), self.tag)
+        elif node.text == value:
+            return
+        node.text = value
+        instance.mark_dirty()
 
 
 class IntegerDescriptor(StringDescriptor):
@@ -862,7 +1006,9 @@ class StringAttributeDescriptor(TagDescriptor):
 
     def __set__(self, instance, value):
         instance.get()
-        instance.root.attrib[self.tag] = value
+        if instance.root.attrib.get(self.tag) != value:
+            instance.root.attrib[self.tag] = value
+            instance.mark_dirty()
 
 
 class EntityDescriptor(TagDescriptor):
@@ -885,9 +1031,11 @@ class EntityDescriptor(TagDescriptor):
         node = self.get_node(instance)
         if node is None:
             # create the new tag
-            node = ElementTree.Element(self.tag)
-            self.rootnode(instance).append(node)
+            node = _sub_element(self.rootnode(instance), self.tag)
+        elif node.attrib.get('uri') == value.uri:
+            return
         node.attrib['uri'] = value.uri
+        instance.mark_dirty()
 
 
 class DimensionDescriptor(TagDescriptor):
@@ -930,11 +1078,14 @@ class MutableDescriptor(BaseDescriptor):
 
     def __get__(self, instance, cls):
         instance.get()
-        return self.muttableklass(instance=instance, **self.kwargs)
+        return self._get_muttable(instance)
 
     def __set__(self, instance, value):
         instance.get()
-        muttable = self.muttableklass(instance=instance, **self.kwargs)
+        muttable = self._get_muttable(instance)
+        if muttable == value:
+            # Nothing would change in the xml
+            return
         muttable.clear()
         if issubclass(self.muttableklass, list):
             return muttable.extend(value)
@@ -942,6 +1093,22 @@ class MutableDescriptor(BaseDescriptor):
             for k in value:
                 muttable[k] = value[k]
 
+    def _get_muttable(self, instance):
+        """
+        Return the muttable object of this instance. It is parsed once and parsed again when the root of the instance
+        is replaced, so changes made to the XML other than through the muttable are not reflected in it.
+        The same object is kept so that the references held by the callers follow the new XML.
+        """
+        muttables = instance.__dict__.setdefault('_muttables', {})
+        root, muttable = muttables.get(self, (None, None))
+        if muttable is None:
+            muttable = self.muttableklass(instance=instance, **self.kwargs)
+            muttables[self] = (instance.root, muttable)
+        elif root is not instance.root:
+            muttable._reload()
+            muttables[self] = (instance.root, muttable)
+        return muttable
+
 
 class UdfDictionaryDescriptor(MutableDescriptor):
     """An instance attribute containing a dictionary of UDF values
@@ -15,10 +15,17 @@ except ImportError:
 from xml.etree import ElementTree
 
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 
+def _check_not_async(lims, action):
+    """Raise a RuntimeError if lims is an AsyncLims, whose requests cannot be sent by a synchronous method."""
+    if getattr(lims, 'is_async', False) is True:
+        raise RuntimeError('%s sends requests and cannot be used with an AsyncLims' % action)
+
+
 class Entity(object):
     """
     Base abstract class for the every entities in the LIMS database.
@@ -30,6 +37,12 @@ class Entity(object):
     _PREFIX = None
     _CREATION_PREFIX = None
     _CREATION_TAG = None
+    # Whether the LIMS provides batch/retrieve for this entity
+    _SUPPORTS_BATCH = False
+    _root = None
+    _retrieved_at = None
+    _validators = None
+    _dirty = False
 
     def __new__(cls, lims, uri=None, id=None, _create_new=False):
         if not uri:
@@ -43,23 +56,27 @@ class Entity(object):
                 pass
             else:
                 raise ValueError("Entity uri and id can't be both None")
-        try:
-            return lims.cache[uri]
-        except KeyError:
-            return object.__new__(cls)
+        if uri:
+            try:
+                return lims.cache[uri]
+            except KeyError:
+                pass
+        return object.__new__(cls)
 
     def __init__(self, lims, uri=None, id=None, _create_new=False):
         assert uri or id or _create_new
         if not _create_new:
             if hasattr(self, 'lims'):
+                lims._add_pending(self)
                 return
             if not uri:
                 uri = lims.get_uri(self._URI, id)
             lims.cache[uri] = self
-            self.root = None
         self.lims = lims
         self._uri = uri
         self.root = None
+        if not _create_new:
+            lims._add_pending(self)
 
     def __str__(self):
         return "%s(%s)" % (self.__class__.__name__, self.id)
@@ -67,6 +84,25 @@ class Entity(object):
     def __repr__(self):
         return "%s(%s)" % (self.__class__.__name__, self.uri)
 
+    @property
+    def root(self):
+        """The XML element of this entity or None if it has not been retrieved yet."""
+        return self._root
+
+    @root.setter
+    def root(self, value):
+        self._root = value
+        self._dirty = False
+        if value is not None:
+            self._retrieved_at = time.time()
+            self.lims.cache.resize(self)
+            # The lists and dictionaries already returned by the descriptors follow the new XML,
+            # otherwise the changes made through them after a refresh would be lost
+            muttables = self.__dict__.get('_muttables', {})
+            for descriptor, (root, muttable) in list(muttables.items()):
+                muttable._reload()
+                muttables[descriptor] = (value, muttable)
+
     @property
     def uri(self):
         try:
@@ -76,19 +112,95 @@ class Entity(object):
 
     @property
     def id(self):
-        """Return the LIMS id; obtained from the URI."""
+        """Return the LIMS id; obtained from the URI. None for an instance that was not created in the LIMS yet."""
+        if self.uri is None:
+            return None
         parts = urlsplit(self.uri)
         return parts.path.split('/')[-1]
 
+    def is_stale(self):
+        """
+        Whether the XML data of this instance needs to be retrieved, either because it was never retrieved or
+        because it is older than the time to live configured in the Lims for this class.
+        An instance modified locally is never stale so that its changes are not lost before being saved.
+        """
+        if self.root is None:
+            return True
+        if self._dirty:
+            return False
+        ttl = self.lims.get_ttl(self.__class__)
+        if ttl is None or not self._uri:
+            return False
+        return time.time() - self._retrieved_at > ttl
+
     def get(self, force=False):
-        """Get the XML data for this instance."""
-        if not force and self.root is not None: return
-        self.root = self.lims.get(self.uri)
+        """
+        Get the XML data for this instance if it has never been retrieved or has expired.
+        When the Lims revalidates, the existing XML is kept if the server reports it has not changed.
+        With a persistent cache, the XML stored on disk is used if it has not expired.
+        Within :py:meth:`Lims.batching <pyclarity_lims.lims.Lims.batching>`, the other pending instances of the same
+        class are retrieved at the same time with batch requests.
+        """
+        if not force and not self.is_stale(): return
+        if getattr(self.lims, 'is_async', False) is True:
+            if force or self.root is None:
+                raise RuntimeError('%s is not loaded: use "await entity.aget()" with an AsyncLims' % self)
+            # An expired XML is only refreshed by aget
+            return
+        if not force and self.root is None and self.lims._load_persisted(self) and not self.is_stale():
+            return
+        if not force and self._SUPPORTS_BATCH and self.lims.is_batching():
+            self.lims._load_pending(self)
+            if not self.is_stale(): return
+        validators = self._get_validators()
+        self._set_retrieved(self.lims.get(self.uri, validators=validators), validators)
+
+    def aget(self, force=False):
+        """
+        Coroutine getting the XML data for this instance through an
+        :py:class:`AsyncLims <pyclarity_lims.async_lims.AsyncLims>`: ``await entity.aget()``.
+        Once loaded, the instance's descriptors can be used as usual.
+        """
+        return self.lims.load(self, force=force)
 
-    def put(self):
-        """Save this instance by doing PUT of its serialized XML."""
-        data = self.lims.tostring(ElementTree.ElementTree(self.root))
-        return self.lims.put(self.uri, data)
+    def _get_validators(self):
+        """Return the validators to send with the GET of this instance when the Lims revalidates, None otherwise."""
+        if not self.lims.revalidate:
+            return None
+        return dict(self._validators or {}) if self.root is not None and not self._dirty else {}
+
+    def _set_retrieved(self, root, validators=None):
+        """Store the XML retrieved for this instance. A root of None means that the current XML was not modified."""
+        if validators is not None:
+            self._validators = validators
+        if root is None:
+            # Not modified: the current XML is up to date again
+            self._retrieved_at = time.time()
+        else:
+            self.root = root
+        self.lims._persist([self])
+
+    def is_dirty(self):
+        """Whether the XML of this instance was modified through its descriptors since it was retrieved or saved."""
+        return self._dirty
+
+    def mark_dirty(self):
+        """
+        Record that the XML of this instance was modified and needs to be saved.
+        Within :py:meth:`Lims.session <pyclarity_lims.lims.Lims.session>`, the instance is saved when the session exits.
+        """
+        self._dirty = True
+        self.lims._add_modified(self)
+
+    def put(self, force=False):
+        """
+        Save this instance by doing PUT of its serialized XML.
+        Nothing is sent if the instance was not modified through its descriptors, unless force is True which is needed
+        after changing its root directly.
+
+        :return: the XML returned by the server, or None if nothing was sent.
+        """
+        return self.lims._put_instance(self, force=force)
 
     def post(self):
         """Save this instance with POST"""
@@ -119,6 +231,7 @@ class Entity(object):
     @classmethod
     def create(cls, lims, **kwargs):
         """Create an instance from attributes then post it to the LIMS"""
+        _check_not_async(lims, '%s.create' % cls.__name__)
         instance = cls._create(lims, **kwargs)
         data = lims.tostring(ElementTree.ElementTree(instance.root))
         instance.root = lims.post(uri=lims.get_uri(cls._URI), data=data)
@@ -200,6 +313,10 @@ class Note(Entity):
 class File(Entity):
     """File attached to a project or a sample."""
 
+    _URI = 'files'
+    _PREFIX = 'file'
+    _SUPPORTS_BATCH = True
+
     attached_to = StringDescriptor('attached-to')
     """The uri of the Entity this file is attached to"""
     content_location = StringDescriptor('content-location')
@@ -242,6 +359,7 @@ class Sample(Entity):
 
     _URI = 'samples'
     _PREFIX = 'smp'
+    _SUPPORTS_BATCH = True
     _CREATION_TAG = 'samplecreation'
 
     name = StringDescriptor('name')
@@ -270,8 +388,8 @@ class Sample(Entity):
 
 
     @classmethod
-    def create(cls, lims, container, position, **kwargs):
-        """Create an instance of Sample from attributes then post it to the LIMS"""
+    def _create(cls, lims, container, position, **kwargs):
+        """Create an instance of Sample located in the container at the given position"""
         if not isinstance(container, Container):
             raise TypeError('%s is not of type Container'%container)
         instance = super(Sample, cls)._create(lims, **kwargs)
@@ -280,11 +398,13 @@ class Sample(Entity):
         ElementTree.SubElement(location, 'container', dict(uri=container.uri))
         position_element = ElementTree.SubElement(location, 'value')
         position_element.text = position
-        data = lims.tostring(ElementTree.ElementTree(instance.root))
-        instance.root = lims.post(uri=lims.get_uri(cls._URI), data=data)
-        instance._uri = instance.root.attrib['uri']
         return instance
 
+    @classmethod
+    def create(cls, lims, container, position, **kwargs):
+        """Create an instance of Sample from attributes then post it to the LIMS"""
+        return super(Sample, cls).create(lims, container=container, position=position, **kwargs)
+
 
 class Containertype(Entity):
     "Type of container for analyte artifacts."
@@ -310,6 +430,7 @@ class Container(Entity):
 
     _URI = 'containers'
     _PREFIX = 'con'
+    _SUPPORTS_BATCH = True
 
     name = StringDescriptor('name')
     """Name of the container"""
@@ -326,13 +447,29 @@ class Container(Entity):
     state = StringDescriptor('state')
     """State of the container. i.e. Populated"""
 
-    def get_placements(self):
+    def get_placements(self, prefetch=None):
         """Get the dictionary of locations and artifacts
-        using the more efficient batch call."""
+        using the more efficient batch call.
+
+        :param prefetch: list of attribute paths such as 'samples' of the entities to retrieve along with the
+                         artifacts, see :py:meth:`Lims.prefetch_related <pyclarity_lims.lims.Lims.prefetch_related>`.
+        """
+        _check_not_async(self.lims, 'Container.get_placements (use "await lims.get_batch(placements.values())")')
         result = self.placements.copy()
-        self.lims.get_batch(list(result.values()))
+        if prefetch:
+            self.lims.prefetch_related(list(result.values()), prefetch)
+        else:
+            self.lims.get_batch(list(result.values()))
         return result
 
+    def set_placements(self, placements):
+        """Replace all the placements of the container.
+        Nothing is modified if the placements are the same as the current ones.
+
+        :param placements: dictionary of locations such as "A:1" and artifacts.
+        """
+        self.placements = placements
+
 
 class Processtype(Entity):
     _TAG = 'process-type'
@@ -453,12 +590,15 @@ class Process(Entity):
                     ins.append(inp)
         return ins
 
-    def all_inputs(self, unique=True, resolve=False):
+    def all_inputs(self, unique=True, resolve=False, prefetch=None):
         """Retrieving all input artifacts from input_output_maps
         if unique is true, no duplicates are returned.
 
         :param unique: boolean specifying if the list of artifact should be uniqued
         :param resolve: boolean specifying if the artifacts entities should be resolved through a batch query.
+        :param prefetch: list of attribute paths such as 'samples' or 'samples.project' of the entities to retrieve
+                         along with the artifacts,
+                         see :py:meth:`Lims.prefetch_related <pyclarity_lims.lims.Lims.prefetch_related>`.
 
         :return: list of input artifact.
 
@@ -471,17 +611,22 @@ class Process(Entity):
             raise TypeError
         if unique:
             ids = list(frozenset(ids))
+        artifacts = [Artifact(self.lims, id=id) for id in ids if id is not None]
+        if prefetch:
+            return self.lims.prefetch_related(artifacts, prefetch)
         if resolve:
-            return self.lims.get_batch([Artifact(self.lims, id=id) for id in ids if id is not None])
-        else:
-            return [Artifact(self.lims, id=id) for id in ids if id is not None]
+            return self.lims.get_batch(artifacts)
+        return artifacts
 
-    def all_outputs(self, unique=True, resolve=False):
+    def all_outputs(self, unique=True, resolve=False, prefetch=None):
         """Retrieving all output artifacts from input_output_maps
         if unique is true, no duplicates are returned.
 
         :param unique: boolean specifying if the list of artifact should be uniqued
         :param resolve: boolean specifying if the artifacts entities should be resolved through a batch query.
+        :param prefetch: list of attribute paths such as 'samples' or 'samples.project' of the entities to retrieve
+                         along with the artifacts,
+                         see :py:meth:`Lims.prefetch_related <pyclarity_lims.lims.Lims.prefetch_related>`.
         :return: list of output artifact.
 
         """
@@ -489,10 +634,12 @@ class Process(Entity):
         ids = [io[1]['limsid'] for io in self.input_output_maps if io[1] is not None]
         if unique:
             ids = list(frozenset(ids))
+        artifacts = [Artifact(self.lims, id=id) for id in ids if id is not None]
+        if prefetch:
+            return self.lims.prefetch_related(artifacts, prefetch)
         if resolve:
-            return self.lims.get_batch([Artifact(self.lims, id=id) for id in ids if id is not None])
-        else:
-            return [Artifact(self.lims, id=id) for id in ids if id is not None]
+            return self.lims.get_batch(artifacts)
+        return artifacts
 
     def shared_result_files(self):
         """Retreve all resultfiles of output-generation-type PerAllInputs."""
@@ -541,6 +688,7 @@ class Artifact(Entity):
 
     _URI = 'artifacts'
     _PREFIX = 'art'
+    _SUPPORTS_BATCH = True
 
     name = StringDescriptor('name')
     """The name of the artifact."""
@@ -746,6 +894,7 @@ class StepActions(Entity):
                     self._escalation['status'] = 'Pending'
 
                 for node2 in node.findall('escalated-artifacts'):
+                    _check_not_async(self.lims, 'StepActions.escalation')
                     art = self.lims.get_batch([Artifact(self.lims, uri=ch.attrib.get('uri')) for ch in node2])
                     self._escalation['artifacts'].extend(art)
         return self._escalation
@@ -838,6 +987,7 @@ class Step(Entity):
         """
         Send a post query to advance the step to the next step
         """
+        _check_not_async(self.lims, 'Step.advance')
         self.root = self.lims.post(
             uri="{}/advance".format(self.uri),
             data=self.lims.tostring(ElementTree.ElementTree(self.root))
@@ -877,6 +1027,7 @@ class Step(Entity):
         :return: The program status.
         :raise ValueError: if the program does not exist.
         """
+        _check_not_async(self.lims, 'Step.trigger_program')
         progs = [ap[1] for ap in self.available_programs if name == ap[0]]
         if not progs:
             raise ValueError('%s not in available program names' % name)
@@ -904,6 +1055,7 @@ class Step(Entity):
                                        C is a string specifying the location in the container such as "1:1"
 
         """
+        _check_not_async(self.lims, 'Step.set_placements')
         self.placement = StepPlacements(self.lims, uri=self.uri + '/placements')
         self.placement.selected_containers = output_containers
         self.placement.placement_list = output_placement_list
@@ -922,6 +1074,7 @@ class Step(Entity):
         :param reagent_category: optional reagent_category.
         :param replicates: int or list of int specifying the number of replicates for each inputs.
         """
+        _check_not_async(lims, 'Step.create')
         instance = super(Step, cls)._create(lims, **kwargs)
         # Check configuratio of the step
         if not isinstance(protocol_step, ProtocolStep):
@@ -1043,6 +1196,7 @@ class ReagentType(Entity):
     def __init__(self, lims, uri=None, id=None):
         super(ReagentType, self).__init__(lims, uri, id)
         assert self.uri is not None
+        _check_not_async(lims, 'ReagentType')
         self.root = lims.get(self.uri)
         self.sequence = None
         for t in self.root.findall('special-type'):
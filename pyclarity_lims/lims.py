@@ -1,24 +1,42 @@
 __all__ = ['Lab', 'Researcher', 'Project', 'Sample',
            'Containertype', 'Container', 'Processtype', 'Process',
-           'Artifact', 'Lims']
+           'Artifact', 'Lims', 'BatchError']
 
+import binascii
+import codecs
+import logging
 import os
 import re
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from io import BytesIO
 import requests
 
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
 # python 2.7, 3+ compatibility
 from sys import version_info
 
 if version_info[0] == 2:
-    from urlparse import urljoin
+    from urlparse import urljoin, urlparse, parse_qs
     from urllib import urlencode
+    string_types = basestring
 else:
-    from urllib.parse import urljoin
+    from urllib.parse import urljoin, urlparse, parse_qs
     from urllib.parse import urlencode
+    string_types = str
 
 
 from .entities import *
+from .cache import EntityCache
+
+logger = logging.getLogger(__name__)
 
 # Python 2.6 support work-arounds
 # - Exception ElementTree.ParseError does not exist
@@ -34,6 +52,68 @@ if version_info[:2] < (2,7):
     ElementTree.ElementTree.write = write_with_xml_declaration
 
 TIMEOUT = 16
+# Number of keep-alive connections kept by the HTTP session (requests default to 10)
+POOL_SIZE = 100
+# Maximum number of entities sent in a single batch request
+BATCH_SIZE = 500
+# Number of batch requests sent concurrently
+MAX_WORKERS = 4
+# Size in bytes of the chunks read from streamed responses
+CHUNK_SIZE = 64 * 1024
+
+
+def _list_tag(klass):
+    """Return the tag of the nodes listing the instances of klass in a list query."""
+    tag = klass._TAG
+    if tag is None:
+        tag = klass.__name__.lower()
+    return tag
+
+
+def _related_entities(instances, attribute):
+    """Return the unique entities referenced by the attribute of the instances."""
+    related = OrderedDict()
+
+    def collect(value):
+        if isinstance(value, Entity):
+            related[(value.__class__, value.uri)] = value
+        elif isinstance(value, dict):
+            for v in value.values():
+                collect(v)
+        elif isinstance(value, (list, tuple)):
+            for v in value:
+                collect(v)
+
+    for instance in instances:
+        collect(getattr(instance, attribute))
+    return list(related.values())
+
+
+class BatchError(requests.exceptions.HTTPError):
+    """
+    Raised when some of the chunks of a batch operation failed. The chunks that succeeded have been applied.
+
+    :param errors: list of tuples (instances, exception) for each chunk that failed.
+    :param created: for :py:meth:`Lims.create_batch`, the list of instances that were created.
+    :param retrieve_errors: for :py:meth:`Lims.create_batch`, list of tuples (instances, exception) for each chunk
+                            of created instances whose content could not be retrieved.
+    """
+
+    def __init__(self, errors, created=None, retrieve_errors=None):
+        self.errors = errors
+        self.created = created
+        self.retrieve_errors = retrieve_errors or []
+        messages = []
+        if errors:
+            messages.append('%s batch request(s) failed: %s' % (len(errors), self._describe(errors)))
+        if self.retrieve_errors:
+            messages.append('%s batch request(s) retrieving the created instances failed: %s' % (
+                len(self.retrieve_errors), self._describe(self.retrieve_errors)))
+        super(BatchError, self).__init__('; '.join(messages))
+
+    @staticmethod
+    def _describe(errors):
+        return '; '.join('%s instances starting with %s: %s' % (len(chunk), chunk[0], e) for chunk, e in errors)
 
 
 class Lims(object):
@@ -44,27 +124,107 @@ class Lims(object):
     :param username: The account name of the user to login as.
     :param password: The password for the user account to login as.
     :param version: The optional LIMS API version, by default 'v2'
+    :param pool_connections: Number of host connection pools kept by the HTTP session.
+    :param pool_maxsize: Maximum number of keep-alive connections kept in each pool.
+    :param cache: Optional :py:class:`EntityCache <pyclarity_lims.cache.EntityCache>` storing the retrieved entities.
+                  By default the cache is never evicted.
+    :param ttl: Optional dict of time to live in seconds keyed by Entity class. The XML of an entity older than
+                its time to live is retrieved again when it is next accessed. Subclasses inherit the setting of
+                their parent class and classes not found never expire.
+    :param revalidate: If True, entities retrieved again are only downloaded if they changed on the server
+                       according to the ETag and Last-Modified headers of the previous response.
+    :param batch_size: Maximum number of entities sent in a single batch request.
+    :param max_workers: Number of batch requests sent concurrently.
+    :param prefetch_pages: Number of pages of list queries requested ahead of the one being parsed.
+                           By default the pages are retrieved one after the other.
+    :param persistent_cache: Optional :py:class:`PersistentCache <pyclarity_lims.cache.PersistentCache>` storing
+                             the XML of entities on disk so that other processes can reuse it.
+    :param xml_backend: 'etree' (default) to parse the XML with the standard library's ElementTree
+                        or 'lxml' to parse and serialize it with lxml, which is faster on large responses.
 
     Example: ::
 
         Lims('https://claritylims.example.com', 'username' , 'Pa55w0rd')
+        # Artifacts are retrieved again after a minute and samples after ten minutes, other entities never expire
+        Lims('https://claritylims.example.com', 'username' , 'Pa55w0rd', ttl={Artifact: 60, Sample: 600})
 
     """
 
     VERSION = 'v2'
 
-    def __init__(self, baseuri, username, password, version=VERSION):
+    def __init__(self, baseuri, username, password, version=VERSION,
+                 pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, cache=None,
+                 ttl=None, revalidate=False, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS,
+                 prefetch_pages=0, persistent_cache=None, xml_backend='etree'):
 
         self.baseuri = baseuri.rstrip('/') + '/'
         self.username = username
         self.password = password
         self.VERSION = version
-        self.cache = dict()
+        self.cache = cache if cache is not None else EntityCache()
+        self.ttl = dict(ttl or {})
+        self.revalidate = revalidate
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.prefetch_pages = prefetch_pages
+        self.persistent_cache = persistent_cache
+        if xml_backend not in ('etree', 'lxml'):
+            raise ValueError("xml_backend must be 'etree' or 'lxml', not %r" % xml_backend)
+        if xml_backend == 'lxml' and lxml_etree is None:
+            raise ImportError('The lxml backend requires lxml: pip install pyclarity_lims[lxml]')
+        self.xml_backend = xml_backend
+        if xml_backend == 'lxml':
+            self._parser = lxml_etree.XMLParser(resolve_entities=False, huge_tree=True)
+        # The batching scopes and sessions only apply to the thread that opened them
+        self._local = threading.local()
         # For optimization purposes, enables requests to persist connections
         self.request_session = requests.Session()
-        # The connection pool has a default size of 10
-        self.adapter = requests.adapters.HTTPAdapter(pool_connections=100, pool_maxsize=100)
+        # Every HTTP verb goes through this session and the same pool serves http and https
+        self.adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
         self.request_session.mount('http://', self.adapter)
+        self.request_session.mount('https://', self.adapter)
+
+    def get_ttl(self, klass):
+        """
+        Return the time to live in seconds of the XML of the provided Entity class, or None if it never expires.
+
+        :param klass: the Entity class
+        """
+        for k in klass.__mro__:
+            if k in self.ttl:
+                return self.ttl[k]
+        return None
+
+    def _load_persisted(self, instance):
+        """Set the XML of the instance from the persistent cache. Return True if it was found."""
+        if self.persistent_cache is None or not instance._uri:
+            return False
+        entry = self.persistent_cache.load(instance.__class__, instance.uri)
+        if entry is None:
+            return False
+        xml, retrieved_at, validators = entry
+        instance.root = self.fromstring(xml)
+        instance._retrieved_at = retrieved_at
+        instance._validators = validators
+        return True
+
+    def _persist(self, instances):
+        """Store the XML of the instances in the persistent cache if their class is stored."""
+        if self.persistent_cache is None:
+            return
+        self.persistent_cache.store([
+            (instance.uri, self.tostring(ElementTree.ElementTree(instance.root)), instance._retrieved_at,
+             instance._validators)
+            for instance in instances
+            if instance.root is not None and self.persistent_cache.stores(instance.__class__)
+        ])
+
+    def _discard_persisted(self, instances):
+        """Remove the instances from the persistent cache after they were modified."""
+        if self.persistent_cache is None:
+            return
+        self.persistent_cache.delete([instance.uri for instance in instances
+                                      if self.persistent_cache.stores(instance.__class__)])
 
     def get_uri(self, *segments, **query):
         """
@@ -80,48 +240,183 @@ class Lims(object):
             url += '?' + urlencode(query)
         return url
 
-    def get(self, uri, params=dict()):
+    def request(self, method, uri, **kwargs):
         """
-        GET data from the URI. It checks the status and return the text of response as an ElementTree.
+        Send an HTTP request through the pooled session so that every call reuses the keep-alive connections.
+        The credentials are added to the request and connection errors are reported with the uri that failed.
 
+        :param method: the HTTP verb in lower case (get, put, post, ...)
         :param uri: the uri to query
-        :param params: dict containing the query parameters
+        :param kwargs: extra arguments passed to the session (params, data, headers, timeout, ...)
 
-        :return the text of response as an ElementTree
+        :return the response object
 
         """
         try:
-            r = self.request_session.get(uri, params=params,
-                                         auth=(self.username, self.password),
-                                         headers=dict(accept='application/xml'),
-                                         timeout=TIMEOUT)
+            return getattr(self.request_session, method)(uri, auth=(self.username, self.password), **kwargs)
         except requests.exceptions.ConnectionError as e:
-            raise type(e)("{0}, Error trying to reach {1}".format(e.message, uri))
+            raise type(e)("{0}, Error trying to reach {1}".format(e, uri))
 
-        else:
-            return self.parse_response(r)
+    def get(self, uri, params=dict(), validators=None):
+        """
+        GET data from the URI. It checks the status and return the text of response as an ElementTree.
 
-    def get_file_contents(self, id=None, uri=None, encoding=None, crlf=False):
-        """Returns the contents of the file of <ID> or <uri>"""
+        :param uri: the uri to query
+        :param params: dict containing the query parameters
+        :param validators: optional dict storing the ETag and Last-Modified headers of the response.
+                           If it already contains them, the request is made conditional on the document having
+                           changed and None is returned when the server replies that it has not.
+
+        :return the text of response as an ElementTree
+
+        """
+        r = self.request('get', uri, params=params,
+                         headers=self._get_headers(validators),
+                         timeout=TIMEOUT)
+        return self._parse_get_response(r, validators)
+
+    def _get_headers(self, validators):
+        """Return the headers of a GET, conditional on the validators of the previous response if there are some."""
+        headers = dict(accept='application/xml')
+        if validators:
+            if validators.get('ETag'):
+                headers['If-None-Match'] = validators['ETag']
+            if validators.get('Last-Modified'):
+                headers['If-Modified-Since'] = validators['Last-Modified']
+        return headers
+
+    def _parse_get_response(self, r, validators):
+        """Parse the response of a GET and record its validators. Return None if the document was not modified."""
+        if validators is not None:
+            if validators and r.status_code == 304:
+                return None
+            validators.clear()
+            for header in ('ETag', 'Last-Modified'):
+                if r.headers.get(header):
+                    validators[header] = r.headers[header]
+        return self.parse_response(r)
+
+    def _file_download_uri(self, id=None, uri=None):
         if id:
-            url = self.get_uri('files', id, 'download')
+            return self.get_uri('files', id, 'download')
         elif uri:
-            url = uri.rstrip('/') + '/download'
-        else:
-            raise ValueError('id or uri required')
+            return uri.rstrip('/') + '/download'
+        raise ValueError('id or uri required')
 
-        r = self.request_session.get(url, auth=(self.username, self.password), timeout=TIMEOUT)
+    def get_file_contents(self, id=None, uri=None, encoding=None, crlf=False):
+        """
+        Returns the contents of the file of <ID> or <uri>.
+        The whole file is loaded in memory: use :py:meth:`download_file` or :py:meth:`iter_file_contents`
+        for large files.
+        """
+        r = self.request('get', self._file_download_uri(id, uri), timeout=TIMEOUT)
         self.validate_response(r)
         if encoding:
             r.encoding = encoding
 
         return r.text.replace('\r\n', '\n') if crlf else r.text
 
-    def upload_new_file(self, entity, file_to_upload):
-        """Upload a file and attach it to the provided entity."""
-        file_to_upload = os.path.abspath(file_to_upload)
-        if not os.path.isfile(file_to_upload):
-            raise IOError("{} not found".format(file_to_upload))
+    @contextmanager
+    def _download(self, id=None, uri=None):
+        """Send a streamed GET for the content of the file of <ID> or <uri> and close the response on exit."""
+        r = self.request('get', self._file_download_uri(id, uri), stream=True, timeout=TIMEOUT)
+        try:
+            self.validate_response(r)
+            yield r
+        finally:
+            r.close()
+
+    def iter_file_contents(self, id=None, uri=None, encoding=None, crlf=False, binary=False, chunk_size=None):
+        """
+        Yield the contents of the file of <ID> or <uri> chunk by chunk as it is downloaded.
+
+        :param encoding: the encoding of the file, default to the one given by the server or utf-8
+        :param crlf: replace the Windows line endings with \\n
+        :param binary: yield the bytes received instead of text, encoding and crlf are then ignored
+        :param chunk_size: the number of bytes read at once, default to CHUNK_SIZE
+        """
+        with self._download(id, uri) as r:
+            chunks = r.iter_content(chunk_size or CHUNK_SIZE)
+            if not binary:
+                chunks = _decode_chunks(chunks, encoding or r.encoding or 'utf-8', crlf)
+            for chunk in chunks:
+                yield chunk
+
+    def iter_file_lines(self, id=None, uri=None, encoding=None, crlf=False, chunk_size=None):
+        """
+        Yield the lines of the file of <ID> or <uri>, with their line ending, as it is downloaded.
+        The parameters are the ones of :py:meth:`iter_file_contents`.
+        """
+        pending = []
+        for text in self.iter_file_contents(id, uri, encoding=encoding, crlf=crlf, chunk_size=chunk_size):
+            start = 0
+            end = text.find('\n') + 1
+            while end:
+                pending.append(text[start:end])
+                yield ''.join(pending)
+                pending = []
+                start = end
+                end = text.find('\n', start) + 1
+            if start < len(text):
+                pending.append(text[start:])
+        if pending:
+            yield ''.join(pending)
+
+    def download_file(self, file, id=None, uri=None, encoding=None, crlf=False, output_encoding=None,
+                      chunk_size=None):
+        """
+        Download the file of <ID> or <uri> chunk by chunk to a path or a file object without loading it in memory.
+        The content is written as received unless crlf or output_encoding are set, in which case it is decoded
+        and encoded again on the fly.
+
+        :param file: the path to write to or a file object opened in binary mode
+        :param encoding: the encoding of the file, default to the one given by the server or utf-8
+        :param crlf: replace the Windows line endings with \\n
+        :param output_encoding: the encoding of the file written, default to encoding
+        :param chunk_size: the number of bytes read at once, default to CHUNK_SIZE
+
+        :return: the number of bytes written
+        """
+        with self._download(id, uri) as r:
+            chunks = r.iter_content(chunk_size or CHUNK_SIZE)
+            if crlf or output_encoding:
+                encoding = encoding or r.encoding or 'utf-8'
+                chunks = _encode_chunks(_decode_chunks(chunks, encoding, crlf), output_encoding or encoding)
+            outfile = file if hasattr(file, 'write') else open(file, 'wb')
+            try:
+                size = 0
+                for chunk in chunks:
+                    outfile.write(chunk)
+                    size += len(chunk)
+            finally:
+                if outfile is not file:
+                    outfile.close()
+        return size
+
+    def upload_new_file(self, entity, file_to_upload, filename=None, progress=None, chunk_size=None):
+        """
+        Upload a file and attach it to the provided entity.
+        The content is streamed through the pooled session chunk by chunk without being loaded in memory.
+
+        :param entity: the entity the file is attached to
+        :param file_to_upload: the path of the file, a file object opened in binary mode, bytes or an iterator
+                               of bytes
+        :param filename: the name of the file in the LIMS, default to the path when file_to_upload is a path and
+                         required otherwise
+        :param progress: optional function called with the number of bytes sent and the total size
+                         (None if unknown) after each chunk
+        :param chunk_size: the number of bytes read at once from paths and file objects, default to CHUNK_SIZE
+
+        :return: the File created
+        """
+        is_path = isinstance(file_to_upload, string_types)
+        if is_path:
+            file_to_upload = os.path.abspath(file_to_upload)
+            if not os.path.isfile(file_to_upload):
+                raise IOError("{} not found".format(file_to_upload))
+            filename = filename or file_to_upload
+        elif not filename:
+            raise ValueError('filename required to upload a file object, bytes or an iterator')
 
         # Request the storage space on glsstorage
         # Create the xml to describe the file
@@ -129,7 +424,7 @@ class Lims(object):
         s = ElementTree.SubElement(root, 'attached-to')
         s.text = entity.uri
         s = ElementTree.SubElement(root, 'original-location')
-        s.text = file_to_upload
+        s.text = filename
         root = self.post(
                 uri=self.get_uri('glsstorage'),
                 data=self.tostring(ElementTree.ElementTree(root))
@@ -143,32 +438,56 @@ class Lims(object):
         file = File(self, uri=root.attrib['uri'])
 
         # Actually upload the file
-        uri = self.get_uri('files', file.id, 'upload')
-        r = requests.post(uri, files={'file': (file_to_upload, open(file_to_upload, 'rb'))},
-                          auth=(self.username, self.password))
-        self.validate_response(r)
+        if is_path:
+            with open(file_to_upload, 'rb') as source:
+                self._upload(file, filename, source, os.path.getsize(file_to_upload), progress, chunk_size)
+        else:
+            self._upload(file, filename, file_to_upload, None, progress, chunk_size)
         return file
 
+    def _upload(self, file, filename, source, size, progress=None, chunk_size=None):
+        """Send the content of source as a streamed multipart body to the upload endpoint of the file."""
+        if isinstance(source, (bytes, bytearray)):
+            chunks, size = [bytes(source)], len(source)
+        elif hasattr(source, 'read'):
+            if size is None:
+                size = _remaining_size(source)
+            chunks = iter(partial(source.read, chunk_size or CHUNK_SIZE), b'')
+        else:
+            chunks = source
+        body = _MultipartFile('file', filename, chunks, size, progress)
+        r = self.request('post', self.get_uri('files', file.id, 'upload'), data=body,
+                         headers={'content-type': body.content_type})
+        self.validate_response(r)
+
     def put(self, uri, data, params=dict()):
         """
         PUT the serialized XML to the given URI.
         Return the response XML as an ElementTree.
         """
-        r = requests.put(uri, data=data, params=params,
-                         auth=(self.username, self.password),
+        r = self.request('put', uri, data=data, params=params,
                          headers={'content-type': 'application/xml',
                                   'accept': 'application/xml'})
         return self.parse_response(r)
 
+    def _put_instance(self, instance, force=False):
+        """PUT the XML of an instance if it was modified, used by :py:meth:`Entity.put`."""
+        if not force and not instance.is_dirty():
+            logger.debug('%s was not modified through its descriptors, nothing is sent (use force=True)', instance)
+            return None
+        self._discard_persisted([instance])
+        root = self.put(instance.uri, self.tostring(ElementTree.ElementTree(instance.root)))
+        instance._dirty = False
+        return root
+
     def post(self, uri, data, params=dict()):
         """
         POST the serialized XML to the given URI.
         Return the response XML as an ElementTree.
         """
-        r = requests.post(uri, data=data, params=params,
-                          auth=(self.username, self.password),
-                          headers={'content-type': 'application/xml',
-                                   'accept': 'application/xml'})
+        r = self.request('post', uri, data=data, params=params,
+                         headers={'content-type': 'application/xml',
+                                  'accept': 'application/xml'})
         return self.parse_response(r, accept_status_codes=[200, 201, 202])
 
     def check_version(self):
@@ -177,8 +496,11 @@ class Lims(object):
         does not match any of the versions given for the API.
         """
         uri = urljoin(self.baseuri, 'api')
-        r = requests.get(uri, auth=(self.username, self.password))
-        root = self.parse_response(r)
+        r = self.request('get', uri)
+        self._check_versions(self.parse_response(r))
+
+    def _check_versions(self, root):
+        """Raise ValueError if the version of this interface is not in the versions returned by the API."""
         tag = nsmap('ver:versions')
         assert tag == root.tag
         for node in root.findall('version'):
@@ -192,7 +514,7 @@ class Lims(object):
         """
         if response.status_code not in accept_status_codes:
             try:
-                root = ElementTree.fromstring(response.content)
+                root = self.fromstring(response.content)
                 node = root.find('message')
                 if node is None:
                     response.raise_for_status()
@@ -212,10 +534,25 @@ class Lims(object):
         Raise an HTTP error if the response status is not 200.
         """
         self.validate_response(response, accept_status_codes)
-        root = ElementTree.fromstring(response.content)
+        root = self.fromstring(response.content)
         return root
 
-    def get_udfs(self, name=None, attach_to_name=None, attach_to_category=None, start_index=None, add_info=False):
+    def fromstring(self, xml):
+        """
+        Parse the XML with the backend of the Lims and return its root element.
+        Invalid XML raises an ElementTree.ParseError with either backend.
+        """
+        if self.xml_backend == 'lxml':
+            if not isinstance(xml, bytes):
+                xml = xml.encode('utf-8')
+            try:
+                return lxml_etree.fromstring(xml, self._parser)
+            except lxml_etree.XMLSyntaxError as e:
+                raise ElementTree.ParseError(str(e))
+        return ElementTree.fromstring(xml)
+
+    def get_udfs(self, name=None, attach_to_name=None, attach_to_category=None, start_index=None, add_info=False,
+                 resolve=False):
         """Get a list of udfs, filtered by keyword arguments.
 
         :param name: name of udf
@@ -226,28 +563,30 @@ class Lims(object):
         :param start_index: Page to retrieve; all if None.
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all udfs retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name,
                                   attach_to_name=attach_to_name,
                                   attach_to_category=attach_to_category,
                                   start_index=start_index)
-        return self._get_instances(Udfconfig, add_info=add_info, params=params)
+        return self._get_instances(Udfconfig, add_info=add_info, params=params, resolve=resolve)
 
-    def get_reagent_types(self, name=None, start_index=None):
+    def get_reagent_types(self, name=None, start_index=None, resolve=False):
         """
         Get a list of reagent types, filtered by keyword arguments.
 
         :param name: Reagent type  name, or list of names.
         :param start_index: Page to retrieve; all if None.
+        :param resolve: Get the content of all reagent types retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name,
                                   start_index=start_index)
-        return self._get_instances(ReagentType, params=params)
+        return self._get_instances(ReagentType, params=params, resolve=resolve)
 
     def get_labs(self, name=None, last_modified=None,
-                 udf=dict(), udtname=None, udt=dict(), start_index=None, add_info=False):
+                 udf=dict(), udtname=None, udt=dict(), start_index=None, add_info=False, resolve=False):
         """Get a list of labs, filtered by keyword arguments.
 
         :param name: Lab name, or list of names.
@@ -259,18 +598,19 @@ class Lims(object):
         :param start_index: Page to retrieve; all if None.
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all labs retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name,
                                   last_modified=last_modified,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Lab, add_info=add_info, params=params)
+        return self._get_instances(Lab, add_info=add_info, params=params, resolve=resolve)
 
     def get_researchers(self, firstname=None, lastname=None, username=None,
                         last_modified=None,
                         udf=dict(), udtname=None, udt=dict(), start_index=None,
-                        add_info=False):
+                        add_info=False, resolve=False):
         """Get a list of researchers, filtered by keyword arguments.
 
         :param firstname: Researcher first name, or list of names.
@@ -284,6 +624,7 @@ class Lims(object):
         :param start_index: Page to retrieve; all if None.
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all researchers retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(firstname=firstname,
@@ -292,11 +633,11 @@ class Lims(object):
                                   last_modified=last_modified,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Researcher, add_info=add_info, params=params)
+        return self._get_instances(Researcher, add_info=add_info, params=params, resolve=resolve)
 
     def get_projects(self, name=None, open_date=None, last_modified=None,
                      udf=dict(), udtname=None, udt=dict(), start_index=None,
-                     add_info=False):
+                     add_info=False, resolve=False):
         """Get a list of projects, filtered by keyword arguments.
 
         :param name: Project name, or list of names.
@@ -309,6 +650,7 @@ class Lims(object):
         :param start_index: Page to retrieve; all if None.
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all projects retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name,
@@ -316,30 +658,54 @@ class Lims(object):
                                   last_modified=last_modified,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Project, add_info=add_info, params=params)
+        return self._get_instances(Project, add_info=add_info, params=params, resolve=resolve)
+
+    def iter_projects(self, name=None, open_date=None, last_modified=None,
+                      udf=dict(), udtname=None, udt=dict(), prefetch_pages=None):
+        """Iterate over the projects matching the keyword arguments, retrieving them page by page.
+
+        :param name: Project name, or list of names.
+        :param open_date: Since the given ISO format date.
+        :param last_modified: Since the given ISO format datetime.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param prefetch_pages: Number of pages retrieved in the background while the current one is consumed,
+                               default to Lims.prefetch_pages.
+
+        """
+        params = self._get_params(name=name,
+                                  open_date=open_date,
+                                  last_modified=last_modified)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return self._iter_instances(Project, params=params, prefetch_pages=prefetch_pages)
 
     def get_sample_number(self, name=None, projectname=None, projectlimsid=None,
                           udf=dict(), udtname=None, udt=dict(), start_index=None):
         """
         Gets the number of samples matching the query without fetching every
-        sample, so it should be faster than len(get_samples())
+        page, so it should be faster than len(get_samples())
+
+        :param name: Sample name, or list of names.
+        :param projectlimsid: Samples for the project of the given LIMS id.
+        :param projectname: Samples for the project of the name.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param start_index: Only count the samples in this page if set.
+
         """
         params = self._get_params(name=name,
                                   projectname=projectname,
                                   projectlimsid=projectlimsid,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        root = self.get(self.get_uri(Sample._URI), params=params)
-        total = 0
-        while params.get('start-index') is None:  # Loop over all pages.
-            total += len(root.findall("sample"))
-            node = root.find('next-page')
-            if node is None: break
-            root = self.get(node.attrib['uri'], params=params)
-        return total
+        return self._count_instances(Sample, params=params)
 
     def get_samples(self, name=None, projectname=None, projectlimsid=None,
-                    udf=dict(), udtname=None, udt=dict(), start_index=None):
+                    udf=dict(), udtname=None, udt=dict(), start_index=None, resolve=False, prefetch=None):
         """Get a list of samples, filtered by keyword arguments.
 
         :param name: Sample name, or list of names.
@@ -350,6 +716,9 @@ class Lims(object):
         :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
                     and a string or list of strings as value.
         :param start_index: Page to retrieve; all if None.
+        :param resolve: Get the content of all samples retrieved with :py:meth:`get_batch`.
+        :param prefetch: list of attribute paths such as 'project' or 'artifact.container' of the entities
+                         to retrieve along with the samples, see :py:meth:`prefetch_related`.
 
         """
         params = self._get_params(name=name,
@@ -357,14 +726,38 @@ class Lims(object):
                                   projectlimsid=projectlimsid,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Sample, params=params)
+        instances = self._get_instances(Sample, params=params, resolve=resolve)
+        if prefetch:
+            return self.prefetch_related(instances, prefetch)
+        return instances
+
+    def iter_samples(self, name=None, projectname=None, projectlimsid=None,
+                     udf=dict(), udtname=None, udt=dict(), prefetch_pages=None):
+        """Iterate over the samples matching the keyword arguments, retrieving them page by page.
+
+        :param name: Sample name, or list of names.
+        :param projectlimsid: Samples for the project of the given LIMS id.
+        :param projectname: Samples for the project of the name.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param prefetch_pages: Number of pages retrieved in the background while the current one is consumed,
+                               default to Lims.prefetch_pages.
+
+        """
+        params = self._get_params(name=name,
+                                  projectname=projectname,
+                                  projectlimsid=projectlimsid)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return self._iter_instances(Sample, params=params, prefetch_pages=prefetch_pages)
 
     def get_artifacts(self, name=None, type=None, process_type=None,
                       artifact_flag_name=None, working_flag=None, qc_flag=None,
                       sample_name=None, samplelimsid=None, artifactgroup=None, containername=None,
                       containerlimsid=None, reagent_label=None,
                       udf=dict(), udtname=None, udt=dict(), start_index=None,
-                      resolve=False):
+                      resolve=False, prefetch=None):
         """Get a list of artifacts, filtered by keyword arguments.
 
         :param name: Artifact name, or list of names.
@@ -385,6 +778,8 @@ class Lims(object):
                     and a string or list of strings as value.
         :param start_index: Page to retrieve; all if None.
         :param resolve: Send a batch query to the lims to get the content of all artifacts retrieved
+        :param prefetch: list of attribute paths such as 'samples', 'samples.project', 'container' or 'parent_process'
+                         of the entities to retrieve along with the artifacts, see :py:meth:`prefetch_related`.
 
         """
         params = self._get_params(name=name,
@@ -401,15 +796,101 @@ class Lims(object):
                                   reagent_label=reagent_label,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        if resolve:
-            return self.get_batch(self._get_instances(Artifact, params=params))
-        else:
-            return self._get_instances(Artifact, params=params)
+        instances = self._get_instances(Artifact, params=params, resolve=resolve)
+        if prefetch:
+            return self.prefetch_related(instances, prefetch)
+        return instances
+
+    def iter_artifacts(self, name=None, type=None, process_type=None,
+                       artifact_flag_name=None, working_flag=None, qc_flag=None,
+                       sample_name=None, samplelimsid=None, artifactgroup=None, containername=None,
+                       containerlimsid=None, reagent_label=None,
+                       udf=dict(), udtname=None, udt=dict(), prefetch_pages=None):
+        """Iterate over the artifacts matching the keyword arguments, retrieving them page by page.
+
+        :param name: Artifact name, or list of names.
+        :param type: Artifact type, or list of types.
+        :param process_type: Produced by the process type, or list of types.
+        :param artifact_flag_name: Tagged with the genealogy flag, or list of flags.
+        :param working_flag: Having the given working flag; boolean.
+        :param qc_flag: Having the given QC flag: UNKNOWN, PASSED, FAILED.
+        :param sample_name: Related to the given sample name.
+        :param samplelimsid: Related to the given sample id.
+        :param artifactgroup: Belonging to the artifact group (experiment in client).
+        :param containername: Residing in given container, by name, or list.
+        :param containerlimsid: Residing in given container, by LIMS id, or list.
+        :param reagent_label: having attached reagent labels.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param prefetch_pages: Number of pages retrieved in the background while the current one is consumed,
+                               default to Lims.prefetch_pages.
+
+        """
+        params = self._get_params(name=name,
+                                  type=type,
+                                  process_type=process_type,
+                                  artifact_flag_name=artifact_flag_name,
+                                  working_flag=working_flag,
+                                  qc_flag=qc_flag,
+                                  sample_name=sample_name,
+                                  samplelimsid=samplelimsid,
+                                  artifactgroup=artifactgroup,
+                                  containername=containername,
+                                  containerlimsid=containerlimsid,
+                                  reagent_label=reagent_label)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return self._iter_instances(Artifact, params=params, prefetch_pages=prefetch_pages)
+
+    def get_artifact_number(self, name=None, type=None, process_type=None,
+                            artifact_flag_name=None, working_flag=None, qc_flag=None,
+                            sample_name=None, samplelimsid=None, artifactgroup=None, containername=None,
+                            containerlimsid=None, reagent_label=None,
+                            udf=dict(), udtname=None, udt=dict(), start_index=None):
+        """
+        Gets the number of artifacts matching the query without fetching every
+        page, so it should be faster than len(get_artifacts())
+
+        :param name: Artifact name, or list of names.
+        :param type: Artifact type, or list of types.
+        :param process_type: Produced by the process type, or list of types.
+        :param artifact_flag_name: Tagged with the genealogy flag, or list of flags.
+        :param working_flag: Having the given working flag; boolean.
+        :param qc_flag: Having the given QC flag: UNKNOWN, PASSED, FAILED.
+        :param sample_name: Related to the given sample name.
+        :param samplelimsid: Related to the given sample id.
+        :param artifactgroup: Belonging to the artifact group (experiment in client).
+        :param containername: Residing in given container, by name, or list.
+        :param containerlimsid: Residing in given container, by LIMS id, or list.
+        :param reagent_label: having attached reagent labels.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param start_index: Only count the artifacts in this page if set.
+
+        """
+        params = self._get_params(name=name,
+                                  type=type,
+                                  process_type=process_type,
+                                  artifact_flag_name=artifact_flag_name,
+                                  working_flag=working_flag,
+                                  qc_flag=qc_flag,
+                                  sample_name=sample_name,
+                                  samplelimsid=samplelimsid,
+                                  artifactgroup=artifactgroup,
+                                  containername=containername,
+                                  containerlimsid=containerlimsid,
+                                  reagent_label=reagent_label,
+                                  start_index=start_index)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return self._count_instances(Artifact, params=params)
 
     def get_containers(self, name=None, type=None,
                        state=None, last_modified=None,
                        udf=dict(), udtname=None, udt=dict(), start_index=None,
-                       add_info=False):
+                       add_info=False, resolve=False, prefetch=None):
         """Get a list of containers, filtered by keyword arguments.
 
         :param name: Containers name, or list of names.
@@ -423,6 +904,9 @@ class Lims(object):
         :param start_index: Page to retrieve; all if None.
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all containers retrieved with :py:meth:`get_batch`.
+        :param prefetch: list of attribute paths such as 'type' or 'placements.samples' of the entities
+                         to retrieve along with the containers, see :py:meth:`prefetch_related`.
 
         """
         params = self._get_params(name=name,
@@ -431,24 +915,80 @@ class Lims(object):
                                   last_modified=last_modified,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Container, add_info=add_info, params=params)
+        instances = self._get_instances(Container, add_info=add_info, params=params, resolve=resolve)
+        if prefetch:
+            if add_info:
+                return self.prefetch_related(instances[0], prefetch), instances[1]
+            return self.prefetch_related(instances, prefetch)
+        return instances
+
+    def iter_containers(self, name=None, type=None,
+                        state=None, last_modified=None,
+                        udf=dict(), udtname=None, udt=dict(), prefetch_pages=None):
+        """Iterate over the containers matching the keyword arguments, retrieving them page by page.
 
-    def get_container_types(self, name=None, start_index=None, add_info=False):
+        :param name: Containers name, or list of names.
+        :param type: Container type, or list of types.
+        :param state: Container state: Empty, Populated, Discarded, Reagent-Only.
+        :param last_modified: Since the given ISO format datetime.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param prefetch_pages: Number of pages retrieved in the background while the current one is consumed,
+                               default to Lims.prefetch_pages.
+
+        """
+        params = self._get_params(name=name,
+                                  type=type,
+                                  state=state,
+                                  last_modified=last_modified)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return self._iter_instances(Container, params=params, prefetch_pages=prefetch_pages)
+
+    def get_container_number(self, name=None, type=None,
+                             state=None, last_modified=None,
+                             udf=dict(), udtname=None, udt=dict(), start_index=None):
+        """
+        Gets the number of containers matching the query without fetching every
+        page, so it should be faster than len(get_containers())
+
+        :param name: Containers name, or list of names.
+        :param type: Container type, or list of types.
+        :param state: Container state: Empty, Populated, Discarded, Reagent-Only.
+        :param last_modified: Since the given ISO format datetime.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param start_index: Only count the containers in this page if set.
+
+        """
+        params = self._get_params(name=name,
+                                  type=type,
+                                  state=state,
+                                  last_modified=last_modified,
+                                  start_index=start_index)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return self._count_instances(Container, params=params)
+
+    def get_container_types(self, name=None, start_index=None, add_info=False, resolve=False):
         """Get a list of container types, filtered by keyword arguments.
 
         :param name: name of the container type or list of names.
         :param start_index: Page to retrieve; all if None.
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all container types retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name, start_index=start_index)
-        return self._get_instances(Containertype, add_info=add_info, params=params)
+        return self._get_instances(Containertype, add_info=add_info, params=params, resolve=resolve)
 
     def get_processes(self, last_modified=None, type=None,
                       inputartifactlimsid=None,
                       techfirstname=None, techlastname=None, projectname=None,
-                      udf=dict(), udtname=None, udt=dict(), start_index=None):
+                      udf=dict(), udtname=None, udt=dict(), start_index=None, resolve=False):
         """Get a list of processes, filtered by keyword arguments.
 
         :param last_modified: Since the given ISO format datetime.
@@ -464,6 +1004,7 @@ class Lims(object):
         :param start_index: Page to retrieve; all if None.
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all processes retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(last_modified=last_modified,
@@ -474,82 +1015,148 @@ class Lims(object):
                                   projectname=projectname,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Process, params=params)
+        return self._get_instances(Process, params=params, resolve=resolve)
+
+    def iter_processes(self, last_modified=None, type=None,
+                       inputartifactlimsid=None,
+                       techfirstname=None, techlastname=None, projectname=None,
+                       udf=dict(), udtname=None, udt=dict(), prefetch_pages=None):
+        """Iterate over the processes matching the keyword arguments, retrieving them page by page.
+
+        :param last_modified: Since the given ISO format datetime.
+        :param type: Process type, or list of types.
+        :param inputartifactlimsid: Input artifact LIMS id, or list of.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param techfirstname: First name of researcher, or list of.
+        :param techlastname: Last name of researcher, or list of.
+        :param projectname: Name of project, or list of.
+        :param prefetch_pages: Number of pages retrieved in the background while the current one is consumed,
+                               default to Lims.prefetch_pages.
 
-    def get_workflows(self, name=None, add_info=False):
+        """
+        params = self._get_params(last_modified=last_modified,
+                                  type=type,
+                                  inputartifactlimsid=inputartifactlimsid,
+                                  techfirstname=techfirstname,
+                                  techlastname=techlastname,
+                                  projectname=projectname)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return self._iter_instances(Process, params=params, prefetch_pages=prefetch_pages)
+
+    def get_process_number(self, last_modified=None, type=None,
+                           inputartifactlimsid=None,
+                           techfirstname=None, techlastname=None, projectname=None,
+                           udf=dict(), udtname=None, udt=dict(), start_index=None):
+        """
+        Gets the number of processes matching the query without fetching every
+        page, so it should be faster than len(get_processes())
+
+        :param last_modified: Since the given ISO format datetime.
+        :param type: Process type, or list of types.
+        :param inputartifactlimsid: Input artifact LIMS id, or list of.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param techfirstname: First name of researcher, or list of.
+        :param techlastname: Last name of researcher, or list of.
+        :param projectname: Name of project, or list of.
+        :param start_index: Only count the processes in this page if set.
+
+        """
+        params = self._get_params(last_modified=last_modified,
+                                  type=type,
+                                  inputartifactlimsid=inputartifactlimsid,
+                                  techfirstname=techfirstname,
+                                  techlastname=techlastname,
+                                  projectname=projectname,
+                                  start_index=start_index)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return self._count_instances(Process, params=params)
+
+    def get_workflows(self, name=None, add_info=False, resolve=False):
         """
         Get the list of existing workflows on the system.
 
         :param name: The name of the workflow you're looking for
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all workflows retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name)
-        return self._get_instances(Workflow, add_info=add_info, params=params)
+        return self._get_instances(Workflow, add_info=add_info, params=params, resolve=resolve)
 
-    def get_process_types(self, displayname=None, add_info=False):
+    def get_process_types(self, displayname=None, add_info=False, resolve=False):
         """
         Get a list of process types with the specified name.
 
         :param displayname: The name the process type
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all process types retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(displayname=displayname)
-        return self._get_instances(Processtype, add_info=add_info, params=params)
+        return self._get_instances(Processtype, add_info=add_info, params=params, resolve=resolve)
 
-    def get_reagent_types(self, name=None, add_info=False):
+    def get_reagent_types(self, name=None, add_info=False, resolve=False):
         """
        Get a list of reagent types with the specified name.
 
        :param name: The name the reagent type
        :param add_info: Change the return type to a tuple where the first element is normal return and
                         the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all reagent types retrieved with :py:meth:`get_batch`.
 
        """
         params = self._get_params(name=name)
-        return self._get_instances(ReagentType, add_info=add_info, params=params)
+        return self._get_instances(ReagentType, add_info=add_info, params=params, resolve=resolve)
 
-    def get_protocols(self, name=None, add_info=False):
+    def get_protocols(self, name=None, add_info=False, resolve=False):
         """
         Get the list of existing protocols on the system.
 
         :param name: The name the protocol
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all protocols retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name)
-        return self._get_instances(Protocol, add_info=add_info, params=params)
+        return self._get_instances(Protocol, add_info=add_info, params=params, resolve=resolve)
 
-    def get_reagent_kits(self, name=None, start_index=None, add_info=False):
+    def get_reagent_kits(self, name=None, start_index=None, add_info=False, resolve=False):
         """Get a list of reagent kits, filtered by keyword arguments.
 
         :param name: reagent kit  name, or list of names.
         :param start_index: Page to retrieve; all if None.
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
+        :param resolve: Get the content of all reagent kits retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name,
                                   start_index=start_index)
-        return self._get_instances(ReagentKit, add_info=add_info, params=params)
+        return self._get_instances(ReagentKit, add_info=add_info, params=params, resolve=resolve)
 
     def get_reagent_lots(self, name=None, kitname=None, number=None,
-                         start_index=None):
+                         start_index=None, resolve=False):
         """Get a list of reagent lots, filtered by keyword arguments.
 
         :param name: reagent kit  name, or list of names.
         :param kitname: name of the kit this lots belong to
         :param number: lot number or list of lot number
         :param start_index: Page to retrieve; all if None.
+        :param resolve: Get the content of all reagent lots retrieved with :py:meth:`get_batch`.
 
         """
         params = self._get_params(name=name, kitname=kitname, number=number,
                                   start_index=start_index)
-        return self._get_instances(ReagentLot, params=params)
+        return self._get_instances(ReagentLot, params=params, resolve=resolve)
 
     def _get_params(self, **kwargs):
         "Convert keyword arguments to a kwargs dictionary."
@@ -570,34 +1177,155 @@ class Lims(object):
             result["udt.%s" % key] = value
         return result
 
-    def _get_instances(self, klass, add_info=None, params=dict()):
-        results = []
-        additionnal_info_dicts = []
-        tag = klass._TAG
-        if tag is None:
-            tag = klass.__name__.lower()
-        root = self.get(self.get_uri(klass._URI), params=params)
-        while params.get('start-index') is None:  # Loop over all pages.
-            for node in root.findall(tag):
-                results.append(klass(self, uri=node.attrib['uri']))
+    def _iter_pages(self, uri, params, prefetch_pages=None):
+        """
+        Yield the root of each page of a list query in order.
+        Only one page is retrieved if params specifies a start-index.
+
+        With prefetch_pages set, the size of the first page is used to request the following pages by start-index.
+        One request is kept in flight at first and the window doubles, up to prefetch_pages, each time a page comes
+        back full, so that short queries are not charged for pages past the end. Otherwise the next-page links are
+        followed one by one.
+        """
+        if prefetch_pages is None:
+            prefetch_pages = self.prefetch_pages
+        root = self.get(uri, params=params)
+        if params.get('start-index') is not None:
+            yield root
+            return
+        node = root.find('next-page')
+        if not prefetch_pages:
+            while node is not None:
+                yield root
+                root = self.get(node.attrib['uri'], params=params)
+                node = root.find('next-page')
+            yield root
+            return
+        if node is None:
+            yield root
+            return
+
+        page_size = self._page_size(node)
+        next_index = [page_size]
+        window = [1]
+        executor = ThreadPoolExecutor(max_workers=int(prefetch_pages))
+        pending = deque()
+
+        def fill():
+            while len(pending) < window[0]:
+                page_params = dict(params)
+                page_params['start-index'] = next_index[0]
+                pending.append(executor.submit(self.get, uri, params=page_params))
+                next_index[0] += page_size
+
+        try:
+            fill()
+            yield root
+            while pending:
+                root = pending.popleft().result()
+                if root.find('next-page') is None:
+                    yield root
+                    return
+                window[0] = min(window[0] * 2, prefetch_pages)
+                fill()
+                yield root
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _page_size(next_page):
+        """Return the size of the pages from the next-page node of the first one."""
+        # The first page starts at 0 so the start-index of the second one is the page size
+        return int(parse_qs(urlparse(next_page.attrib['uri']).query)['start-index'][0])
+
+    def _iter_instances(self, klass, add_info=False, params=dict(), prefetch_pages=None):
+        """
+        Yield the instances of klass returned by a list query as each page is retrieved.
+        If add_info is True, yield tuples (instance, dict of the additional information provided in the query).
+        """
+        for root in self._iter_pages(self.get_uri(klass._URI), params, prefetch_pages=prefetch_pages):
+            for item in self._page_instances(klass, root, add_info):
+                yield item
+
+    def _page_instances(self, klass, root, add_info=False):
+        """Yield the instances of klass listed in the root of a page, with their additional information if add_info."""
+        for node in root.findall(_list_tag(klass)):
+            instance = klass(self, uri=node.attrib['uri'])
+            if add_info:
                 info_dict = {}
                 for attrib_key in node.attrib:
                     info_dict[attrib_key] = node.attrib[attrib_key]
                 for subnode in node:
                     info_dict[subnode.tag] = subnode.text
+                yield instance, info_dict
+            else:
+                yield instance
+
+    def _count_instances(self, klass, params=dict()):
+        """Count the instances of klass returned by a list query."""
+        uri = self.get_uri(klass._URI)
+        probes = self._count_probes(klass, params)
+        step = next(probes)
+        while isinstance(step, dict):
+            step = probes.send(self.get(uri, params=step))
+        return step
+
+    def _count_probes(self, klass, params):
+        """
+        Generator driving the count of a list query: it yields the parameters of the next page to retrieve and
+        is sent back the root of that page, until it yields the number of instances.
+        The pages all have the same size so the last one is found by probing start-indexes, doubling the page number
+        then bisecting, and only the entries of the last page are counted.
+        """
+        tag = _list_tag(klass)
+        root = yield dict(params)
+        nb_entries = len(root.findall(tag))
+        if params.get('start-index') is not None or root.find('next-page') is None:
+            yield nb_entries
+            return
+        page_size = nb_entries
+
+        # lower is a page followed by another one, upper is a page past the end
+        lower, upper = 0, None
+        page = 1
+        while upper is None or upper - lower > 1:
+            page_params = dict(params)
+            page_params['start-index'] = page * page_size
+            root = yield page_params
+            nb_entries = len(root.findall(tag))
+            if root.find('next-page') is not None:
+                lower = page
+            elif nb_entries:
+                yield page * page_size + nb_entries
+                return
+            else:
+                upper = page
+            page = page * 2 if upper is None else (lower + upper) // 2
+        # The entries changed while probing and the page after lower is now empty
+        yield upper * page_size
+
+    def _get_instances(self, klass, add_info=None, params=dict(), resolve=False):
+        results = []
+        additionnal_info_dicts = []
+        for item in self._iter_instances(klass, add_info=add_info, params=params):
+            if add_info:
+                instance, info_dict = item
                 additionnal_info_dicts.append(info_dict)
-            node = root.find('next-page')
-            if node is None: break
-            root = self.get(node.attrib['uri'], params=params)
+            else:
+                instance = item
+            results.append(instance)
+        if resolve:
+            self.get_batch(results)
         if add_info:
             return results, additionnal_info_dicts
-        else:
-            return results
+        return results
 
-    def get_batch(self, instances, force=False):
+    def get_batch(self, instances, force=False, batch_size=None):
         """Get the content of a set of instances using the efficient batch call.
 
-        Returns the list of requested instances in arbitrary order, with duplicates removed
+        Returns the list of requested instances, with duplicates removed
         (duplicates=entities occurring more than once in the instances argument).
 
         For Artifacts it is possible to have multiple instances with the same LIMSID but
@@ -610,56 +1338,432 @@ class Lims(object):
         state into a single result with state equal to the state of the Artifact
         occurring at the last position in the list.
 
+        The instances are split in chunks of batch_size that are retrieved concurrently.
+        If some chunks fail, the others are still loaded and a :py:class:`BatchError` is raised.
+        The entities that have no batch endpoint, such as projects or processes, are retrieved with one GET each,
+        sending up to Lims.max_workers of them concurrently.
+
         :param instances: List of instances children of Entity
         :param force: optional argument to force the download of already cached instances
+        :param batch_size: optional maximum number of instances per request, default to Lims.batch_size
         """
         if not instances:
             return []
-        root = ElementTree.Element(nsmap('ri:links'))
-        needs_request = False
-        instance_map = {}
+        instance_map, to_retrieve = self._group_batch(instances, force)
+        errors = []
+        for klass, klass_instances in to_retrieve.items():
+            if klass._SUPPORTS_BATCH:
+                results, klass_errors = self._map_chunks(partial(self._retrieve_batch, klass), klass_instances,
+                                                         batch_size)
+                # The roots are set in the calling thread, where the entities they reference are created
+                for chunk, nodes in results:
+                    self._load_nodes(chunk, nodes)
+            else:
+                # Without batch endpoint, the instances are retrieved one by one on Lims.max_workers threads
+                results, klass_errors = self._map_chunks(self._retrieve_each, klass_instances, batch_size=1)
+                for chunk, retrieved in results:
+                    for instance, root, validators in retrieved:
+                        instance._set_retrieved(root, validators)
+            errors.extend(klass_errors)
+        if errors:
+            raise BatchError(errors)
+        return list(instance_map.values())
+
+    def _group_batch(self, instances, force=False):
+        """
+        Return an OrderedDict of the unique instances keyed by (class, id)
+        and a dict of the ones that need to be retrieved keyed by class.
+        """
+        instance_map = OrderedDict()
         for instance in instances:
-            instance_map[instance.id] = instance
-            if force or instance.root is None:
-                ElementTree.SubElement(root, 'link', dict(uri=instance.uri,
-                                                          rel=instance.__class__._URI))
-                needs_request = True
+            instance_map[(instance.__class__, instance.id)] = instance
 
-        if needs_request:
-            uri = self.get_uri(instance.__class__._URI, 'batch/retrieve')
-            data = self.tostring(ElementTree.ElementTree(root))
-            root = self.post(uri, data)
-            for node in root.getchildren():
-                instance = instance_map[node.attrib['limsid']]
-                instance.root = node
-        return instance_map.values()
+        to_retrieve = defaultdict(list)
+        for (klass, limsid), instance in instance_map.items():
+            if not force and instance.root is None and self._load_persisted(instance) and not instance.is_stale():
+                continue
+            if force or instance.is_stale():
+                to_retrieve[klass].append(instance)
+        return instance_map, to_retrieve
 
-    def put_batch(self, instances):
+    def _retrieve_each(self, instances):
+        """
+        Retrieve the instances one by one and return tuples (instance, root, validators)
+        so that their roots are set in the calling thread.
         """
-        Update multiple instances using a single batch request.
+        retrieved = []
+        for instance in instances:
+            validators = instance._get_validators()
+            retrieved.append((instance, self.get(instance.uri, validators=validators), validators))
+        return retrieved
+
+    def _load_nodes(self, instances, nodes):
+        """Set the root of the instances from the elements of a batch/retrieve response."""
+        chunk_map = dict((instance.id, instance) for instance in instances)
+        for node in nodes:
+            chunk_map[node.attrib['limsid']].root = node
+        self._persist(instances)
+
+    def prefetch_related(self, instances, paths):
+        """
+        Retrieve the instances and the entities they reference along the provided attribute paths, one level at
+        a time with one :py:meth:`get_batch` per class, so that accessing them afterwards sends no request.
 
         :param instances: List of instances children of Entity
+        :param paths: list of attribute paths separated by dots such as 'samples' or 'samples.project'.
+                      The attributes can reference an entity, a list of entities, or tuples and dicts containing
+                      entities such as location or placements.
+        :return: the instances
+
+        Example: ::
+
+            artifacts = lims.get_artifacts(containername='plate1')
+            lims.prefetch_related(artifacts, ['samples.project', 'container'])
+
+        """
+        self.get_batch(instances)
+        self._prefetch_tree(instances, self._path_tree(paths))
+        return instances
+
+    @staticmethod
+    def _path_tree(paths):
+        """Return the attribute paths as nested OrderedDicts so that the common prefixes are only walked once."""
+        tree = OrderedDict()
+        for path in paths:
+            node = tree
+            for attribute in path.split('.'):
+                node = node.setdefault(attribute, OrderedDict())
+        return tree
+
+    def _prefetch_tree(self, instances, tree):
+        for attribute, subtree in tree.items():
+            related = _related_entities(instances, attribute)
+            self.get_batch(related)
+            self._prefetch_tree(related, subtree)
+
+    @contextmanager
+    def batching(self):
+        """
+        Context manager coalescing the retrieval of entities: within it, the first access to an unloaded artifact,
+        sample, container or file retrieves it together with all the other unloaded instances of its class
+        created or requested in the scope, using :py:meth:`get_batch`. It only applies to the current thread.
+
+        Example: ::
+
+            with lims.batching():
+                # One batch request instead of one request per artifact
+                names = [a.name for a in process.all_outputs()]
+
+        """
+        self._batching += 1
+        try:
+            yield self
+        finally:
+            self._batching -= 1
+            if not self._batching:
+                self._pending.clear()
+
+    @contextmanager
+    def session(self):
+        """
+        Context manager collecting the entities modified through their descriptors by the current thread within it.
+        The modifications made by other threads sharing the Lims are not collected. When the scope exits
+        without error, they are saved together: artifacts, samples, containers and files with :py:meth:`put_batch`
+        and the other classes with concurrent PUTs. If some of the requests fail, the others are still saved and a
+        :py:class:`BatchError` is raised. Nothing is saved if the scope raises and the entities are left modified.
+
+        Example: ::
 
+            with lims.session():
+                for artifact in artifacts:
+                    artifact.udf['Concentration'] = concentrations[artifact.name]
+            # One batch request per chunk of modified artifacts
+
+        """
+        self._sessions += 1
+        success = False
+        try:
+            yield self
+            success = True
+        finally:
+            modified = self._close_session()
+        if success and modified:
+            self._flush(modified)
+
+    @property
+    def _sessions(self):
+        """Depth of the nested sessions opened by the current thread."""
+        return getattr(self._local, 'sessions', 0)
+
+    @_sessions.setter
+    def _sessions(self, value):
+        self._local.sessions = value
+
+    @property
+    def _modified(self):
+        """The instances modified within the sessions of the current thread, keyed by uri."""
+        if not hasattr(self._local, 'modified'):
+            self._local.modified = OrderedDict()
+        return self._local.modified
+
+    def _close_session(self):
+        """Exit one session and return the modified instances to save when it was the outermost."""
+        self._sessions -= 1
+        if self._sessions:
+            return []
+        modified = self._to_update(list(self._modified.values()))
+        self._modified.clear()
+        return modified
+
+    def _add_modified(self, instance):
+        """Record an instance modified within a session."""
+        if self._sessions and instance._uri:
+            self._modified[instance.uri] = instance
+
+    def _flush(self, instances):
+        """Save the instances with batch requests or concurrent PUTs and raise a BatchError for the failures."""
+        errors = []
+        for klass, klass_instances in self._group_by_class(instances).items():
+            if klass._SUPPORTS_BATCH:
+                results, klass_errors = self._map_chunks(partial(self._post_details, klass, 'batch/update'),
+                                                         klass_instances)
+                self._load_updated(results)
+            else:
+                results, klass_errors = self._map_chunks(self._put_each, klass_instances, batch_size=1)
+            errors.extend(klass_errors)
+        if errors:
+            raise BatchError(errors)
+
+    def _put_each(self, instances):
+        for instance in instances:
+            self._put_instance(instance)
+
+    @property
+    def _batching(self):
+        """Depth of the nested batching scopes opened by the current thread."""
+        return getattr(self._local, 'batching', 0)
+
+    @_batching.setter
+    def _batching(self, value):
+        self._local.batching = value
+
+    @property
+    def _pending(self):
+        """The unloaded instances created in the batching scopes of the current thread, keyed by class then uri."""
+        if not hasattr(self._local, 'pending'):
+            self._local.pending = defaultdict(OrderedDict)
+        return self._local.pending
+
+    def is_batching(self):
+        """Whether the retrieval of entities is currently coalesced by :py:meth:`batching` in the current thread."""
+        return self._batching > 0
+
+    def _add_pending(self, instance):
+        """Record an unloaded instance to be retrieved with the next batch of its class."""
+        if self._batching and instance._SUPPORTS_BATCH and instance.is_stale():
+            self._pending[instance.__class__][instance.uri] = instance
+
+    def _load_pending(self, instance):
+        """Retrieve the instance along with the other pending instances of its class."""
+        pending = self._pending.pop(instance.__class__, OrderedDict())
+        pending[instance.uri] = instance
+        try:
+            self.get_batch(list(pending.values()))
+        except BatchError:
+            # The instances of the failed chunks are retrieved one by one, reporting their own error
+            pass
+
+    def _retrieve_batch(self, klass, instances):
+        """
+        Send a single batch/retrieve request for the instances and return the elements of the response.
+        The response is parsed as it is downloaded and each element is detached from the document once complete.
+        """
+        r = self.request('post', self.get_uri(klass._URI, 'batch/retrieve'), data=self._links_xml(klass, instances),
+                         headers={'content-type': 'application/xml',
+                                  'accept': 'application/xml'},
+                         stream=True)
+        try:
+            self.validate_response(r)
+            return list(self._iter_children(r))
+        finally:
+            r.close()
+
+    def _links_xml(self, klass, instances):
+        """Return the serialized links to the instances sent to batch/retrieve."""
+        root = ElementTree.Element(nsmap('ri:links'))
+        for instance in instances:
+            ElementTree.SubElement(root, 'link', dict(uri=instance.uri, rel=klass._URI))
+        return self.tostring(ElementTree.ElementTree(root))
+
+    def _iter_children(self, response):
+        """
+        Parse the body of a streamed response incrementally and yield each child of the root element once it is
+        complete. The children are detached from the root so that the whole document is never held in memory.
         """
+        source = _ChunkReader(response.iter_content(CHUNK_SIZE))
+        if self.xml_backend == 'lxml':
+            events = lxml_etree.iterparse(source, events=('start', 'end'), resolve_entities=False, huge_tree=True)
+        else:
+            events = ElementTree.iterparse(source, events=('start', 'end'))
+        root = None
+        depth = 0
+        for event, node in events:
+            if event == 'start':
+                if root is None:
+                    root = node
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 1:
+                    root.remove(node)
+                    yield node
+
+    def _map_chunks(self, function, items, batch_size=None):
+        """
+        Split the items in chunks of batch_size and call the function on each of them,
+        running up to Lims.max_workers chunks concurrently.
+
+        :return: a tuple of two lists: (chunk, result) for the chunks that succeeded in the original order and
+                 (chunk, exception) for the chunks that failed.
+        """
+        chunks = self._split_chunks(items, batch_size)
+
+        def call(chunk):
+            try:
+                return True, function(chunk)
+            except Exception as e:
+                return False, e
 
+        if len(chunks) > 1 and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks))) as executor:
+                outcomes = list(executor.map(call, chunks))
+        else:
+            outcomes = [call(chunk) for chunk in chunks]
+        results = [(chunk, value) for chunk, (success, value) in zip(chunks, outcomes) if success]
+        errors = [(chunk, value) for chunk, (success, value) in zip(chunks, outcomes) if not success]
+        return results, errors
+
+    def _split_chunks(self, items, batch_size=None):
+        """Split the items in lists of at most batch_size, default to Lims.batch_size."""
+        batch_size = batch_size or self.batch_size
+        return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    def put_batch(self, instances, batch_size=None, force=False):
+        """
+        Update multiple instances using batch requests.
+
+        Only the instances modified through their descriptors are sent unless force is True. This changed in 0.4.4:
+        the instances whose root was edited directly are skipped and need force=True to be sent.
+        The instances are split in chunks of batch_size that are sent concurrently.
+        When the server answers with the XML of the updated instances, it replaces their root.
+        If some chunks fail, the others are still saved and a :py:class:`BatchError` is raised.
+
+        :param instances: List of instances children of Entity
+        :param batch_size: optional maximum number of instances per request, default to Lims.batch_size
+        :param force: send all the instances, including the unmodified ones
+
+        """
+        instances = self._to_update(instances, force)
         if not instances:
             return
 
-        root = None  # XML root element for batch request
-
+        errors = []
+        for klass, klass_instances in self._group_by_class(instances).items():
+            results, klass_errors = self._map_chunks(partial(self._post_details, klass, 'batch/update'),
+                                                     klass_instances, batch_size)
+            self._load_updated(results)
+            errors.extend(klass_errors)
+        if errors:
+            raise BatchError(errors)
+
+    @staticmethod
+    def _to_update(instances, force=False):
+        """Return the instances that need to be saved."""
+        to_update = [instance for instance in instances or [] if force or instance.is_dirty()]
+        if len(to_update) < len(instances or []):
+            logger.debug('%s instances were not modified through their descriptors, they are not sent '
+                         '(use force=True)', len(instances) - len(to_update))
+        return to_update
+
+    @staticmethod
+    def _group_by_class(instances):
+        """Return an OrderedDict of the lists of instances keyed by class."""
+        by_class = OrderedDict()
         for instance in instances:
-            if root is None:
-                klass = instance.__class__
-                # Tag is art:details, con:details, etc.
-                example_root = instance.root
-                ns_uri = re.match("{(.*)}.*", example_root.tag).group(1)
-                root = ElementTree.Element("{%s}details" % (ns_uri))
+            by_class.setdefault(instance.__class__, []).append(instance)
+        return by_class
+
+    def _load_updated(self, results):
+        """Set the root of the instances from the (chunk, response) of batch/update requests."""
+        for chunk, root in results:
+            self._discard_persisted(chunk)
+            for instance in chunk:
+                instance._dirty = False
+            chunk_map = dict((instance.id, instance) for instance in chunk)
+            for node in root:
+                # The response can also be a list of links to the updated instances
+                instance = chunk_map.get(node.attrib.get('limsid'))
+                if instance is not None and node.tag == instance.root.tag:
+                    instance.root = node
+
+    def create_batch(self, klass, kwargs_list, batch_size=None):
+        """
+        Create multiple instances using batch requests. This is supported for samples and containers.
 
-            root.append(instance.root)
+        The instances are split in chunks of batch_size that are sent concurrently. Once created, the instances
+        are added to the cache and their content is retrieved with :py:meth:`get_batch`.
+        If some chunks fail to be created or retrieved, the others are still created and a :py:class:`BatchError` is
+        raised. Its errors are the chunks that were not created, its created attribute lists the instances that were
+        and its retrieve_errors the chunks that were created but could not be retrieved.
+
+        :param klass: The class of the instances to create i.e. Sample or Container.
+        :param kwargs_list: List of dicts each containing the arguments used to create one instance,
+                            as they would be passed to klass.create.
+        :param batch_size: optional maximum number of instances per request, default to Lims.batch_size
+        :return: the list of instances in the same order as kwargs_list.
+
+        Example: ::
 
-        uri = self.get_uri(klass._URI, 'batch/update')
-        data = self.tostring(ElementTree.ElementTree(root))
-        root = self.post(uri, data)
+            lims.create_batch(Sample, [dict(container=plate, position='A:1', name='s1', project=project),
+                                       dict(container=plate, position='B:1', name='s2', project=project)])
+
+        """
+        instances = [klass._create(self, **kwargs) for kwargs in kwargs_list]
+        if not instances:
+            return []
+        results, errors = self._map_chunks(partial(self._post_details, klass, 'batch/create'), instances, batch_size)
+        created = self._register_created(results)
+        try:
+            self.get_batch(created)
+        except BatchError as e:
+            # Report the creation errors with the retrieval ones so that the caller knows what was created
+            raise BatchError(errors, created=created, retrieve_errors=e.errors)
+        if errors:
+            raise BatchError(errors, created=created)
+        return instances
+
+    def _register_created(self, results):
+        """Set the uri of the instances from the (chunk, response) of batch/create requests and return them."""
+        created = []
+        for chunk, root in results:
+            # The links to the new instances are returned in the order they were sent
+            for instance, node in zip(chunk, root.findall('link')):
+                instance._uri = node.attrib['uri']
+                instance.root = None
+                self.cache[instance.uri] = instance
+                created.append(instance)
+        return created
+
+    def _post_details(self, klass, action, instances):
+        """Send the instances in a single batch request for the action (batch/update, ...) and return the response."""
+        # Tag is art:details, con:details, etc.
+        ns_uri = re.match("{(.*)}.*", instances[0].root.tag).group(1)
+        # Use the XML implementation of the instances so that their root can be appended
+        root = instances[0].root.makeelement("{%s}details" % (ns_uri), {})
+        for instance in instances:
+            root.append(instance.root)
+        uri = self.get_uri(klass._URI, action)
+        return self.post(uri, self.tostring(ElementTree.ElementTree(root)))
 
     def route_artifacts(self, artifact_list, workflow_uri=None, stage_uri=None, unassign=False):
         """
@@ -672,6 +1776,14 @@ class Lims(object):
         :param unassign: If True, then the artifact will be removed from the queue instead of added.
 
         """
+        uri = self.get_uri('route', 'artifacts')
+        r = self.request('post', uri, data=self._routing_xml(artifact_list, workflow_uri, stage_uri, unassign),
+                         headers={'content-type': 'application/xml',
+                                  'accept': 'application/xml'})
+        self.validate_response(r)
+
+    def _routing_xml(self, artifact_list, workflow_uri=None, stage_uri=None, unassign=False):
+        """Return the serialized routing request for route_artifacts."""
         root = ElementTree.Element(nsmap('rt:routing'))
         if unassign:
             s = ElementTree.SubElement(root, 'unassign')
@@ -684,13 +1796,7 @@ class Lims(object):
         for artifact in artifact_list:
             a = ElementTree.SubElement(s, 'artifact')
             a.set('uri', artifact.uri)
-
-        uri = self.get_uri('route', 'artifacts')
-        r = requests.post(uri, data=self.tostring(ElementTree.ElementTree(root)),
-                          auth=(self.username, self.password),
-                          headers={'content-type': 'application/xml',
-                                   'accept': 'application/xml'})
-        self.validate_response(r)
+        return self.tostring(ElementTree.ElementTree(root))
 
     def tostring(self, etree):
         """Return the ElementTree contents as a UTF-8 encoded XML string."""
@@ -700,4 +1806,103 @@ class Lims(object):
 
     def write(self, outfile, etree):
         """Write the ElementTree contents as UTF-8 encoded XML to the open file."""
-        etree.write(outfile, encoding='utf-8', xml_declaration=True)
+        root = etree.getroot()
+        if lxml_etree is not None and lxml_etree.iselement(root):
+            # Elements parsed with the lxml backend
+            outfile.write(lxml_etree.tostring(root, encoding='utf-8', xml_declaration=True))
+        else:
+            etree.write(outfile, encoding='utf-8', xml_declaration=True)
+
+
+class _ChunkReader(object):
+    """
+    File-like object reading the chunks provided by an iterator, such as the iter_content of a response.
+    Like a socket, read returns the data already received rather than waiting for size bytes.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b''
+
+    def read(self, size=-1):
+        if not self.buffer:
+            self.buffer = next(self.chunks, b'')
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def _decode_chunks(chunks, encoding, crlf=False):
+    """
+    Decode the chunks of bytes with an incremental decoder so that the characters split between two chunks are
+    decoded once complete. With crlf, a trailing \\r is kept until the next chunk to replace the \\r\\n spanning two
+    chunks.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        text = pending + decoder.decode(chunk)
+        if crlf:
+            if text.endswith('\r'):
+                text, pending = text[:-1], '\r'
+            else:
+                pending = ''
+            text = text.replace('\r\n', '\n')
+        if text:
+            yield text
+    text = pending + decoder.decode(b'', True)
+    if text:
+        yield text.replace('\r\n', '\n') if crlf else text
+
+
+def _encode_chunks(texts, encoding):
+    """Encode the chunks of text with an incremental encoder so that the byte order mark is written once."""
+    encoder = codecs.getincrementalencoder(encoding)()
+    for text in texts:
+        yield encoder.encode(text)
+    yield encoder.encode('', True)
+
+
+def _remaining_size(source):
+    """Return the number of bytes left to read in a seekable file object, or None if it cannot seek."""
+    try:
+        position = source.tell()
+        source.seek(0, os.SEEK_END)
+        size = source.tell() - position
+        source.seek(position)
+        return size
+    except (AttributeError, IOError, OSError):
+        return None
+
+
+class _MultipartFile(_ChunkReader):
+    """
+    multipart/form-data body made of a single file field, read chunk by chunk when requests sends it.
+    Its len is the size of the body when the size of the file is known, otherwise the body is sent with the
+    chunked transfer encoding.
+    """
+
+    def __init__(self, name, filename, chunks, size=None, progress=None):
+        boundary = binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.content_type = 'multipart/form-data; boundary=' + boundary
+        self.head = ('--%s\r\nContent-Disposition: form-data; name="%s"; filename="%s"\r\n'
+                     'Content-Type: application/octet-stream\r\n\r\n'
+                     % (boundary, name, filename.replace('"', '%22'))).encode('utf-8')
+        self.tail = ('\r\n--%s--\r\n' % boundary).encode('ascii')
+        self.len = None if size is None else len(self.head) + size + len(self.tail)
+        _ChunkReader.__init__(self, self._iter_parts(chunks, size, progress))
+
+    def _iter_parts(self, chunks, size, progress):
+        yield self.head
+        sent = 0
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+                sent += len(chunk)
+                if progress:
+                    progress(sent, size)
+        yield self.tail
+
+    def __iter__(self):
+        return self.chunks
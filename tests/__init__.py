@@ -39,3 +39,14 @@ def print_etree(etree):
     ElementTree.ElementTree(etree).write(outfile, encoding='utf-8', xml_declaration=True)
     sys.stdout.buffer.write(outfile.getvalue())
 
+
+
+def streamed_response(content, status_code=200, raw=None):
+    """Return a requests Response whose body is read from raw, like a response sent with stream=True."""
+    from requests.models import Response
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    r = Response()
+    r.status_code = status_code
+    r.raw = raw or BytesIO(content)
+    return r
@@ -0,0 +1,6 @@
+from sys import version_info
+
+# AsyncLims and its tests use the async syntax of python 3.6 and do not compile on older interpreters
+collect_ignore = []
+if version_info < (3, 6):
+    collect_ignore.append('test_async_lims.py')
@@ -0,0 +1,207 @@
+import asyncio
+from xml.etree import ElementTree
+from unittest import TestCase, skipIf
+
+from requests.exceptions import HTTPError
+
+from pyclarity_lims.entities import Artifact, Container, Project, Sample, Step
+from pyclarity_lims.lims import BatchError
+from pyclarity_lims.async_lims import AsyncLims, _Response, _query_items, aiohttp
+from tests import test_lims
+
+from unittest.mock import patch
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@skipIf(aiohttp is None, 'aiohttp is not installed')
+class TestAsyncLims(TestCase):
+    url = 'http://testgenologics.com:4040'
+    username = 'test'
+    password = 'password'
+    artifact_xml = '<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s" limsid="%s">' \
+                   '<name>%s</name></art:artifact>'
+
+    def setUp(self):
+        self.lims = AsyncLims(self.url, username=self.username, password=self.password, batch_size=2)
+        self.requests = []
+        self.list_pages = test_lims.TestLims()._sample_pages(3)
+
+    async def fake_request(self, method, uri, params=None, **kwargs):
+        """Answer the requests like the LIMS would, using the mocks of test_lims."""
+        self.requests.append((method, uri, params))
+        if method == 'post':
+            mocked = test_lims.TestLims._batch_retrieve_response(uri, kwargs['data'])
+        elif uri.startswith(self.url + '/api/v2/samples') or uri == self.url + '/api/v2/artifacts':
+            mocked = self.list_pages(uri, params=params)
+        else:
+            limsid = uri.split('/')[-1]
+            mocked = _Response(uri, 200, {'ETag': '"1"'}, self.artifact_xml % (uri, limsid, limsid))
+        await asyncio.sleep(0)
+        return _Response(uri, mocked.status_code, getattr(mocked, 'headers', {}), mocked.content)
+
+    def test_aget(self):
+        a = Artifact(self.lims, id='a1')
+        with self.assertRaises(RuntimeError):
+            a.name
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            assert run(a.aget()) is a
+            assert a.name == 'a1'
+            run(a.aget())
+        assert len(self.requests) == 1
+        assert self.requests[0][:2] == ('get', a.uri)
+
+    def test_entity_requests_raise(self):
+        container = Container(self.lims, id='c1')
+        container.root = ElementTree.fromstring(
+            '<con:container xmlns:con="http://genologics.com/ri/container" uri="%s" limsid="c1"><placement uri="%s">'
+            '<value>A:1</value></placement></con:container>' % (container.uri, Artifact(self.lims, id='a1').uri)
+        )
+        step = Step(self.lims, id='s1')
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            self.assertRaises(RuntimeError, Project.create, self.lims, name='p1')
+            self.assertRaises(RuntimeError, container.get_placements)
+            self.assertRaises(RuntimeError, step.set_placements, [container], [])
+            self.assertRaises(RuntimeError, step.advance)
+        assert self.requests == []
+
+    def test_file_transfers_raise(self):
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            self.assertRaises(RuntimeError, self.lims.get_file_contents, id='f1')
+            self.assertRaises(RuntimeError, self.lims.iter_file_contents, id='f1')
+            self.assertRaises(RuntimeError, self.lims.iter_file_lines, id='f1')
+            self.assertRaises(RuntimeError, self.lims.download_file, 'out.txt', id='f1')
+            self.assertRaises(RuntimeError, self.lims.upload_new_file, Artifact(self.lims, id='a1'), 'in.txt')
+        assert self.requests == []
+
+    def test_aget_revalidate(self):
+        lims = AsyncLims(self.url, username=self.username, password=self.password, revalidate=True)
+        a = Artifact(lims, id='a1')
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            run(a.aget())
+        assert a._validators == {'ETag': '"1"'}
+
+    def test_get_batch(self):
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(5)]
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            assert run(self.lims.get_batch(artifacts + artifacts[:1])) == artifacts
+        assert [a.name for a in artifacts] == ['a0', 'a1', 'a2', 'a3', 'a4']
+        # 3 chunks of 2 artifacts
+        assert len(self.requests) == 3
+
+    def test_get_batch_partial_failure(self):
+        artifacts = [Artifact(self.lims, id=i) for i in ('a1', 'a2', 'fail', 'a3')]
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            with self.assertRaises(BatchError) as context:
+                run(self.lims.get_batch(artifacts))
+        assert context.exception.errors[0][0] == artifacts[2:]
+        assert artifacts[0].name == 'a1'
+
+    def test_get_samples(self):
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            samples = run(self.lims.get_samples(name='s1'))
+            assert samples == [Sample(self.lims, id='s%s' % i) for i in range(6)]
+            assert self.requests[0][2] == {'name': 's1'}
+            assert run(self.lims.get_sample_number()) == 6
+
+            async def collect():
+                return [s.id async for s in self.lims.iter_samples(prefetch_pages=2)]
+            assert run(collect()) == ['s0', 's1', 's2', 's3', 's4', 's5']
+
+        self.list_pages = test_lims.TestLims()._sample_pages(2, page_size=10, nb_samples=11)
+        self.requests = []
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            async def collect():
+                return [s.id async for s in self.lims.iter_samples(prefetch_pages=8)]
+            assert len(run(collect())) == 11
+        assert len(self.requests) == 2
+
+    def test_get_artifacts_resolve(self):
+        def fake_get(uri, params=None, **kwargs):
+            content = '<art:artifacts xmlns:art="http://genologics.com/ri/artifact">%s</art:artifacts>' % ''.join(
+                '<artifact uri="%s/api/v2/artifacts/a%s" limsid="a%s"/>' % (self.url, i, i) for i in range(3)
+            )
+            return _Response(uri, 200, {}, content)
+
+        self.list_pages = fake_get
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            artifacts = run(self.lims.get_artifacts(resolve=True))
+        assert [a.name for a in artifacts] == ['a0', 'a1', 'a2']
+
+    def test_prefetch_related(self):
+        mocks = test_lims.TestLims()
+
+        async def fake_request(method, uri, data=None, **kwargs):
+            if method == 'post':
+                mocked = mocks._related_batch_response(uri, data)
+            else:
+                mocked = mocks._related_get_response(uri)
+            self.requests.append(method)
+            return _Response(uri, 200, {}, mocked.content)
+
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(2)]
+        with patch.object(AsyncLims, 'request', side_effect=fake_request):
+            run(self.lims.prefetch_related(artifacts, ['samples.project', 'container']))
+        assert [a.samples[0].project.name for a in artifacts] == ['p1', 'p1']
+        assert [a.container.name for a in artifacts] == ['c1', 'c1']
+        assert sorted(self.requests) == ['get', 'post', 'post', 'post']
+
+    def test_get_containers_prefetch(self):
+        async def fake_request(method, uri, data=None, params=None, **kwargs):
+            self.requests.append(method)
+            if method == 'post':
+                content = '<con:details xmlns:con="http://genologics.com/ri/container">%s</con:details>' % ''.join(
+                    '<con:container uri="{0}/api/v2/containers/c{1}" limsid="c{1}"><name>c{1}</name>'
+                    '<type uri="{0}/api/v2/containertypes/1"/></con:container>'.format(self.url, i) for i in range(2)
+                )
+            elif uri.endswith('/containers'):
+                content = '<con:containers xmlns:con="http://genologics.com/ri/container">%s</con:containers>' % \
+                          ''.join('<container uri="{0}/api/v2/containers/c{1}" limsid="c{1}"/>'.format(self.url, i)
+                                  for i in range(2))
+            else:
+                content = '<ctp:container-type xmlns:ctp="http://genologics.com/ri/containertype" uri="%s" ' \
+                          'name="96 well plate"/>' % uri
+            return _Response(uri, 200, {}, content)
+
+        with patch.object(AsyncLims, 'request', side_effect=fake_request):
+            containers = run(self.lims.get_containers(prefetch=['type']))
+            assert [c.name for c in containers] == ['c0', 'c1']
+            assert [c.type.name for c in containers] == ['96 well plate', '96 well plate']
+            containers, info = run(self.lims.get_containers(add_info=True, prefetch=['type']))
+            assert [c.name for c in containers] == ['c0', 'c1']
+            assert len(info) == 2
+        assert self.requests == ['get', 'post', 'get', 'get']
+
+    def test_session(self):
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(3)]
+        with patch.object(AsyncLims, 'request', side_effect=self.fake_request):
+            run(self.lims.get_batch(artifacts))
+
+            async def modify():
+                async with self.lims.session():
+                    for a in artifacts[:2]:
+                        a.name = a.id + ' new'
+            run(modify())
+        assert [r[0] for r in self.requests] == ['post', 'post', 'post']
+        assert self.requests[-1][1].endswith('artifacts/batch/update')
+        assert [a.is_dirty() for a in artifacts] == [False, False, False]
+
+    def test_error(self):
+        async def fake_request(method, uri, **kwargs):
+            return _Response(uri, 400, {}, test_lims.TestLims.error_xml)
+
+        with patch.object(AsyncLims, 'request', side_effect=fake_request):
+            with self.assertRaises(HTTPError) as context:
+                run(self.lims.get(self.url + '/api/v2/artifacts/a1'))
+        assert str(context.exception) == '400: Generic error message'
+
+    def test_query_items(self):
+        assert sorted(_query_items({'name': ['s1', 's2'], 'start-index': 500, 'type': None})) == [
+            ('name', 's1'), ('name', 's2'), ('start-index', '500')
+        ]
@@ -0,0 +1,126 @@
+import gc
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from xml.etree import ElementTree
+
+from pyclarity_lims.cache import EntityCache, PersistentCache, xml_size
+from pyclarity_lims.entities import Artifact, Processtype
+from pyclarity_lims.lims import Lims
+
+from sys import version_info
+if version_info[0] == 2:
+    from mock import patch, Mock
+else:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+
+class TestEntityCache(TestCase):
+
+    def test_lookup_counters(self):
+        lims = Lims(url, username='test', password='password')
+        a1 = Artifact(lims, id='a1')
+        assert Artifact(lims, id='a1') is a1
+        assert lims.cache.hits == 1
+        Artifact(lims, id='a2')
+        assert lims.cache.misses == 2
+        assert len(lims.cache) == 2
+
+    def test_dict_interface(self):
+        lims = Lims(url, username='test', password='password')
+        a1 = Artifact(lims, id='a1')
+        a2 = Artifact(lims, id='a2')
+        misses = lims.cache.misses
+        assert sorted(lims.cache) == [a1.uri, a2.uri]
+        assert sorted(lims.cache.keys()) == [a1.uri, a2.uri]
+        assert set(lims.cache.values()) == set([a1, a2])
+        assert dict(lims.cache.items()) == {a1.uri: a1, a2.uri: a2}
+        assert dict(lims.cache) == {a1.uri: a1, a2.uri: a2}
+        assert lims.cache.misses == misses
+        assert lims.cache.pop(a1.uri) is a1
+        assert a1.uri not in lims.cache
+
+    def test_evict_max_entries(self):
+        cache = EntityCache(max_entries=2)
+        lims = Lims(url, username='test', password='password', cache=cache)
+        a1 = Artifact(lims, id='a1')
+        Artifact(lims, id='a2')
+        Artifact(lims, id='a3')
+        assert cache.evictions == 1
+        gc.collect()
+        # a2 and a3 are still in the cache, a1 was evicted but is still used so it is returned as is
+        assert len(cache._recent) == 2
+        assert Artifact(lims, id='a1') is a1
+        assert lims.get_uri('artifacts', 'a2') not in cache._recent
+
+    def test_evicted_entity_released(self):
+        cache = EntityCache(max_entries=1)
+        lims = Lims(url, username='test', password='password', cache=cache)
+        Artifact(lims, id='a1')
+        Artifact(lims, id='a2')
+        gc.collect()
+        assert lims.get_uri('artifacts', 'a1') not in cache
+        assert len(cache) == 1
+
+    def test_evict_max_bytes(self):
+        root = ElementTree.fromstring('<art:artifact xmlns:art="http://genologics.com/ri/artifact">'
+                                      '<name>test</name></art:artifact>')
+        size = xml_size(root)
+        cache = EntityCache(max_bytes=size * 2)
+        lims = Lims(url, username='test', password='password', cache=cache)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(3)]
+        assert cache.size == 0
+        for a in artifacts:
+            a.root = root
+        assert cache.evictions == 1
+        assert cache.size == size * 2
+        assert list(cache._recent.values()) == artifacts[1:]
+
+
+class TestPersistentCache(TestCase):
+    processtype_xml = '<ptp:process-type xmlns:ptp="http://genologics.com/ri/processtype" uri="%s" name="pt1"/>'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_store_load(self):
+        cache = PersistentCache(self.path, expiry={Processtype: 60})
+        uri = url + '/api/v2/processtypes/1'
+        cache.store([(uri, b'<a/>', time.time(), {'ETag': '"1"'})])
+        # Another connection to the same database, as from another process
+        xml, retrieved_at, validators = PersistentCache(self.path, expiry={Processtype: 60}).load(Processtype, uri)
+        assert xml == b'<a/>'
+        assert validators == {'ETag': '"1"'}
+        # Artifacts are not stored
+        assert cache.load(Artifact, uri) is None
+        # Expired
+        cache.store([(uri, b'<a/>', time.time() - 120, {})])
+        assert cache.load(Processtype, uri) is None
+        cache.delete([uri])
+        assert PersistentCache(self.path, expiry={Processtype: None}).load(Processtype, uri) is None
+
+    def test_lims_get(self):
+        uri = url + '/api/v2/processtypes/1'
+        response = Mock(content=self.processtype_xml % uri, status_code=200, headers={})
+        lims = Lims(url, username='test', password='password', persistent_cache=PersistentCache(self.path))
+        with patch('requests.Session.get', return_value=response) as mocked_get:
+            assert Processtype(lims, uri=uri).name == 'pt1'
+            assert mocked_get.call_count == 1
+
+        # A new Lims, as in the next run of a script, reads the processtype from the disk
+        lims = Lims(url, username='test', password='password', persistent_cache=PersistentCache(self.path))
+        with patch('requests.Session.get', return_value=response) as mocked_get:
+            assert Processtype(lims, uri=uri).name == 'pt1'
+            assert lims.get_batch([Processtype(lims, uri=uri)])
+            assert mocked_get.call_count == 0
+            # Forcing the retrieval still sends the request
+            Processtype(lims, uri=uri).get(force=True)
+            assert mocked_get.call_count == 1
@@ -1,6 +1,6 @@
 from io import BytesIO
 from sys import version_info
-from unittest import TestCase
+from unittest import TestCase, skipIf
 from xml.etree import ElementTree
 
 import datetime
@@ -12,7 +12,7 @@ from pyclarity_lims.descriptors import StringDescriptor, StringAttributeDescript
     InputOutputMapList, EntityListDescriptor, PlacementDictionary, EntityList, SubTagDictionary, ExternalidList,\
     XmlElementAttributeDict, XmlAttributeList, XmlReagentLabelList, XmlPooledInputDict, XmlAction, QueuedArtifactList
 from pyclarity_lims.entities import Artifact, ProtocolStep, Container
-from pyclarity_lims.lims import Lims
+from pyclarity_lims.lims import Lims, lxml_etree
 from tests import elements_equal
 
 if version_info[0] == 2:
@@ -49,6 +49,12 @@ class TestStringDescriptor(TestDescriptor):
         sd = self._make_desc(StringDescriptor, 'name')
         sd.__set__(self.instance, "new test name")
         assert self.et.find('name').text == "new test name"
+        assert self.instance.mark_dirty.call_count == 1
+
+    def test__set__unchanged(self):
+        sd = self._make_desc(StringDescriptor, 'name')
+        sd.__set__(self.instance, "test name")
+        assert self.instance.mark_dirty.call_count == 0
 
     def test_create(self):
         instance_new = Mock(root=ElementTree.Element('test-entry'))
@@ -223,6 +229,18 @@ class TestStringListDescriptor(TestDescriptor):
         assert isinstance(res, list)
         assert res == ['A02', 'B02']
 
+    def test__get__cached(self):
+        sd = self._make_desc(StringListDescriptor, 'test-subentry')
+        res = sd.__get__(self.instance1, None)
+        assert sd.__get__(self.instance1, None) is res
+        sd.__set__(self.instance1, ['A02'])
+        assert sd.__get__(self.instance1, None) is res
+        assert res == ['A02']
+        # The same list is parsed again when the root is replaced
+        self.instance1.root = self.instance2.root
+        assert sd.__get__(self.instance1, None) is res
+        assert res == []
+
 
 class TestStringDictionaryDescriptor(TestDescriptor):
     def setUp(self):
@@ -288,6 +306,13 @@ class TestUdfDictionary(TestCase):
         assert self.dict2.__getitem__('test') == self._get_udf_value(self.dict2, 'test')
         self.assertRaises(KeyError, self.dict_fail.__getitem__, 'test')
 
+    def test___setitem__unchanged(self):
+        self.dict1['test'] = 'stuff'
+        self.dict1['how much'] = 42
+        assert self.instance1.mark_dirty.call_count == 0
+        self.dict1['how much'] = 43
+        assert self.instance1.mark_dirty.call_count == 1
+
     def test___setitem__(self):
         assert self._get_udf_value(self.dict1, 'test') == 'stuff'
         self.dict1.__setitem__('test', 'other')
@@ -351,6 +376,24 @@ class TestUdfDictionary(TestCase):
             self.dict1['test']
         assert self._get_udf_value(self.dict1, 'test') is None
 
+    def test___delitem__new(self):
+        self.dict1['new string'] = 'new stuff'
+        del self.dict1['new string']
+        assert self._get_udf_value(self.dict1, 'new string') is None
+        assert len(self.instance1.root.findall(nsmap('udf:field'))) == 3
+        self.dict1['new string'] = 'new stuff'
+        assert len(self.instance1.root.findall(nsmap('udf:field'))) == 4
+
+    def test_update(self):
+        self.dict1.update({'test': 'other', 'how much': 42, 'new numeric': 21}, really=False)
+        assert self.dict1 == {'test': 'other', 'how much': 42, 'new numeric': 21, 'really?': True, 'really': False}
+        assert self._get_udf_value(self.dict1, 'test') == 'other'
+        assert self._get_udf_value(self.dict1, 'new numeric') == '21'
+        assert self._get_udf_value(self.dict1, 'really') == 'false'
+        assert len(self.instance1.root.findall(nsmap('udf:field'))) == 5
+        with pytest.raises(TypeError):
+            self.dict1.update({'how much': 'a lot'})
+
     def test_items(self):
         pass
 
@@ -359,6 +402,20 @@ class TestUdfDictionary(TestCase):
         self.dict1.clear()
         assert not self.dict1
         assert len(self.dict1) == 0
+        assert self.instance1.root.findall(nsmap('udf:field')) == []
+
+    def test_clear_udt(self):
+        et = ElementTree.fromstring("""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<test-entry xmlns:udf="http://genologics.com/ri/userdefined">
+<udf:type name="udt name">
+<udf:field type="String" name="test">stuff</udf:field>
+</udf:type>
+</test-entry>""")
+        udt = UdfDictionary(Mock(root=et), udt=True)
+        assert udt == {'test': 'stuff'}
+        udt.clear()
+        udt['other'] = 'value'
+        assert [e.attrib['name'] for e in et.find(nsmap('udf:type'))] == ['other']
 
     def test___iter__(self):
         expected_content = [
@@ -422,6 +479,18 @@ class TestPlacementDictionary(TestDescriptor):
         assert len(self.dict1.rootnode(self.dict1.instance).findall('placement')) == 0
         assert sd.__get__(self.instance1, None) == "thing"
 
+    def test_index(self):
+        art2 = Artifact(lims=self.lims, id='a2')
+        self.dict1['A:2'] = art2
+        self.dict1['A:1'] = art2
+        del self.dict1['A:2']
+        placements = self.dict1.rootnode(self.dict1.instance).findall('placement')
+        assert [(p.attrib['limsid'], p.find('value').text) for p in placements] == [('a2', 'A:1')]
+        assert self.dict1._elems == placements
+        self.dict1['A:2'] = self.art1
+        assert self.dict1 == {'A:1': art2, 'A:2': self.art1}
+        assert self.dict1._index['A:2'].attrib['uri'] == self.art1.uri
+
 
 class TestSubTagDictionary(TestCase):
 
@@ -558,6 +627,14 @@ class TestEntityList(TestDescriptor):
         assert el[0] == self.a1
         assert el[1] == self.a2
 
+    def test_setitem_unchanged(self):
+        el = EntityList(self.instance1, 'artifact', Artifact)
+        el[0] = self.a1
+        assert self.instance1.mark_dirty.call_count == 0
+        el[0] = self.a2
+        assert self.instance1.mark_dirty.call_count == 1
+        assert [e.attrib['uri'] for e in el.instance.root.findall('artifact')] == [self.a2.uri, self.a2.uri]
+
     def test_append(self):
         el = EntityList(self.instance1, 'artifact', Artifact)
         assert len(el) == 2
@@ -613,6 +690,30 @@ class TestEntityList(TestDescriptor):
         assert len(el) == 0
         assert sd.__get__(self.instance1, None) == "thing"
 
+    def test_extend_iadd(self):
+        el = EntityList(self.instance1, 'artifact', Artifact)
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(3, 6)]
+        el.extend(a for a in artifacts[:2])
+        el += artifacts[2:]
+        assert el == [self.a1, self.a2] + artifacts
+        assert el._elems == el.instance.root.findall('artifact')
+        assert [e.attrib['uri'] for e in el._elems] == [a.uri for a in el]
+
+    def test_insert_before_other_element(self):
+        et = ElementTree.fromstring("""<test-entry>
+    <other>thing</other>
+    <artifact uri="http://testgenologics.com:4040/api/v2/artifacts/a1"></artifact>
+    </test-entry>""")
+        el = EntityList(Mock(root=et, lims=self.lims), 'artifact', Artifact)
+        a3 = Artifact(self.lims, id='a3')
+        el.insert(0, a3)
+        el.insert(10, self.a2)
+        assert [e.tag for e in et] == ['other', 'artifact', 'artifact', 'artifact']
+        assert [e.attrib['uri'] for e in et.findall('artifact')] == [a3.uri, self.a1.uri, self.a2.uri]
+        el[1] = self.a2
+        assert [e.attrib['uri'] for e in et.findall('artifact')] == [a3.uri, self.a2.uri, self.a2.uri]
+        assert el._elems == et.findall('artifact')
+
 
 class TestInputOutputMapList(TestCase):
     def setUp(self):
@@ -693,6 +794,16 @@ class TestXmlAttributeList(TestCase):
             ElementTree.fromstring('''<test-tag attrib1="value21" />''')
         )
 
+    def test_extend_elements(self):
+        el = XmlAttributeList(self.instance1, tag='test-tag', nesting=['test-tags'])
+        el.extend({'attrib1': 'value%s' % i} for i in range(3))
+        el.insert(1, {'attrib1': 'inserted'})
+        nodes = el.instance.root.find('test-tags').findall('test-tag')
+        # Each dict is bound to its element instead of looking it up by position
+        assert [d.element for d in el] == nodes
+        el[3]['attrib2'] = 'new'
+        assert nodes[3].attrib == {'attrib1': 'value0', 'attrib2': 'new'}
+
     def test_insert(self):
         el = XmlAttributeList(self.instance1, tag='test-tag', nesting=['test-tags'])
         el.insert(1, {'attrib1': 'value21'})
@@ -704,6 +815,18 @@ class TestXmlAttributeList(TestCase):
             el.instance.root.find('test-tags').findall('test-tag')[2],
             ElementTree.fromstring('''<test-tag attrib1="value11" attrib2="value12" attrib3="value13" />''')
         )
+        # The dicts after the inserted one follow their element
+        assert el[2] == {'attrib1': 'value11', 'attrib2': 'value12', 'attrib3': 'value13'}
+
+    def test_iadd(self):
+        el = XmlAttributeList(self.instance1, tag='test-tag', nesting=['test-tags'])
+        el += [{'attrib1': 'value21'}, {'attrib1': 'value31'}]
+        assert el[3] == {'attrib1': 'value31'}
+        el[3]['attrib2'] = 'value32'
+        elements_equal(
+            el.instance.root.find('test-tags').findall('test-tag')[3],
+            ElementTree.fromstring('''<test-tag attrib1="value31" attrib2="value32" />''')
+        )
 
 
 class TestXmlReagentLabelList(TestCase):
@@ -827,3 +950,32 @@ class TestQueuedArtifactList(TestCase):
             queued_artifacts.append(qart)
 
 
+@skipIf(lxml_etree is None, 'lxml is not installed')
+class TestLxmlElements(TestCase):
+    """The descriptors create their elements with the implementation of the parsed XML."""
+
+    def setUp(self):
+        self.lims = Lims('http://testgenologics.com:4040', username='test', password='password', xml_backend='lxml')
+        root = self.lims.fromstring('''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<test-entry xmlns:udf="http://genologics.com/ri/userdefined">
+<udf:field type="String" name="test">stuff</udf:field>
+<placement uri="http://testgenologics.com:4040/api/v2/artifacts/a1" limsid="a1"><value>A:1</value></placement>
+</test-entry>''')
+        self.instance = Mock(root=root, lims=self.lims)
+        self.a2 = Artifact(self.lims, id='a2')
+
+    def test_descriptors(self):
+        StringDescriptor('name').__set__(self.instance, 'test name')
+        udf = UdfDictionary(self.instance)
+        udf['test'] = 'other'
+        udf['new'] = 1
+        placements = PlacementDictionary(self.instance)
+        placements['B:1'] = self.a2
+        labels = XmlReagentLabelList(self.instance, nesting=['labels'])
+        labels.append('label1')
+        sent = ElementTree.fromstring(self.lims.tostring(ElementTree.ElementTree(self.instance.root)))
+        assert sent.find('name').text == 'test name'
+        assert [e.text for e in sent.findall(nsmap('udf:field'))] == ['other', '1']
+        assert [e.find('value').text for e in sent.findall('placement')] == ['A:1', 'B:1']
+        assert sent.find('labels/reagent-label').attrib['name'] == 'label1'
+        assert UdfDictionary(self.instance) == {'test': 'other', 'new': 1}
@@ -2,10 +2,11 @@ from sys import version_info
 from unittest import TestCase
 from xml.etree import ElementTree
 
-from pyclarity_lims.entities import ProtocolStep, StepActions, Researcher, Artifact, \
+from pyclarity_lims.entities import Entity, ProtocolStep, StepActions, Researcher, Artifact, \
     Step, StepPlacements, Container, Stage, ReagentKit, ReagentLot, Sample, Project
+from pyclarity_lims.constants import nsmap
 from pyclarity_lims.lims import Lims
-from tests import NamedMock, elements_equal
+from tests import NamedMock, elements_equal, streamed_response
 
 if version_info[0] == 2:
     from mock import patch, Mock
@@ -190,7 +191,7 @@ class TestStepActions(TestEntities):
     def test_escalation(self):
         s = StepActions(uri=self.lims.get_uri('steps', 'step_id', 'actions'), lims=self.lims)
         with patch('requests.Session.get', return_value=Mock(content=self.step_actions_xml, status_code=200)):
-            with patch('requests.post', return_value=Mock(content=self.dummy_xml, status_code=200)):
+            with patch('requests.Session.post', return_value=streamed_response(self.dummy_xml)):
                 r = Researcher(uri='http://testgenologics.com:4040/researchers/r1', lims=self.lims)
                 a = Artifact(uri='http://testgenologics.com:4040/artifacts/r1', lims=self.lims)
                 expected_escalation = {
@@ -272,7 +273,7 @@ class TestStep(TestEntities):
             uri='http://testgenologics.com:4040/api/v2/configuration//protocols/p1/steps/p1s1',
             permitted_containers=['Tube']
         )
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.step_xml, status_code=201)) as patch_post:
             Step.create(self.lims, protocol_step=protocol_step, inputs=inputs, replicates=[1, 2])
             data = '''<?xml version='1.0' encoding='utf-8'?>
@@ -300,7 +301,7 @@ class TestStep(TestEntities):
             uri='http://testgenologics.com:4040/api/v2/configuration//protocols/p1/steps/p1s1',
             permitted_containers=['Tube']
         )
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.step_xml, status_code=201)) as patch_post:
             # replicates default to 1
             Step.create(self.lims, protocol_step=protocol_step, inputs=inputs)
@@ -337,7 +338,7 @@ class TestStep(TestEntities):
         with patch('requests.Session.get', return_value=Mock(content=self.step_xml, status_code=200)):
             s = Step(self.lims, id='s1')
             s.get()
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.step_prog_status, status_code=201)) as patch_post:
             prog_status = s.trigger_program('program1')
             assert prog_status.message == 'Traceback Error message'
@@ -375,7 +376,7 @@ class TestReagentKits(TestEntities):
             assert r.archived == False
 
     def test_create_entity(self):
-        with patch('pyclarity_lims.lims.requests.post', return_value=Mock(content=self.reagentkit_xml, status_code=201)):
+        with patch('requests.Session.post', return_value=Mock(content=self.reagentkit_xml, status_code=201)):
             r = ReagentKit.create(self.lims, name='regaentkitname', supplier='reagentProvider',
                                   website='www.reagentprovider.com', archived=False)
         self.assertRaises(TypeError, ReagentKit.create, self.lims, error='test')
@@ -396,7 +397,7 @@ class TestReagentLots(TestEntities):
     def test_create_entity(self):
         with patch('requests.Session.get', return_value=Mock(content=self.reagentkit_xml, status_code=200)):
             r = ReagentKit(uri=self.lims.get_uri('reagentkits', 'r1'), lims=self.lims)
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.reagentlot_xml, status_code=201)) as patch_post:
             l = ReagentLot.create(
                     self.lims,
@@ -415,7 +416,7 @@ class TestSample(TestEntities):
     sample_creation = generic_sample_creation_xml.format(url=url)
 
     def test_create_entity(self):
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.sample_creation, status_code=201)) as patch_post:
             l = Sample.create(
                 self.lims,
@@ -434,3 +435,138 @@ class TestSample(TestEntities):
             </location>
             </smp:samplecreation>'''
             assert elements_equal(ElementTree.fromstring(patch_post.call_args_list[0][1]['data']), ElementTree.fromstring(data))
+
+
+class TestContainer(TestEntities):
+    container_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<con:container xmlns:con="http://genologics.com/ri/container" uri="{url}/containers/c1" limsid="c1">
+<name>plate1</name>
+<placement uri="{url}/artifacts/a1" limsid="a1"><value>A:1</value></placement>
+<placement uri="{url}/artifacts/a2" limsid="a2"><value>B:1</value></placement>
+<state>Populated</state>
+</con:container>""".format(url=url)
+
+    def test_set_placements(self):
+        c = Container(self.lims, id='c1')
+        a1, a2, a3 = [Artifact(self.lims, uri=url + '/artifacts/a%s' % i) for i in range(1, 4)]
+        with patch('requests.Session.get', return_value=Mock(content=self.container_xml, status_code=200)):
+            c.set_placements({'B:1': a2, 'A:1': a1})
+            assert not c.is_dirty()
+            c.set_placements({'A:1': a3, 'C:1': a1})
+        assert c.is_dirty()
+        assert c.placements == {'A:1': a3, 'C:1': a1}
+        placements = sorted((p.find('value').text, p.attrib['uri']) for p in c.root.findall('placement'))
+        assert placements == [('A:1', a3.uri), ('C:1', a1.uri)]
+        assert c.name == 'plate1'
+
+
+class TestEntityTTL(TestEntities):
+    artifact_xml = generic_artifact_xml.format(url=url)
+
+    def test_get_ttl(self):
+        lims = Lims(url, username='test', password='password', ttl={Artifact: 60, Entity: 3600})
+        assert lims.get_ttl(Artifact) == 60
+        assert lims.get_ttl(Sample) == 3600
+        assert self.lims.get_ttl(Artifact) is None
+
+    def test_get_expired(self):
+        lims = Lims(url, username='test', password='password', ttl={Artifact: 60})
+        a = Artifact(lims, id='a1')
+        p = Project(lims, id='p1')
+        with patch('requests.Session.get', return_value=Mock(content=self.artifact_xml, status_code=200)) as mocked_get:
+            assert a.name == 'test_sample1'
+            p.get()
+            assert mocked_get.call_count == 2
+            assert a.name == 'test_sample1'
+            assert mocked_get.call_count == 2
+            with patch('pyclarity_lims.entities.time.time', return_value=a._retrieved_at + 61):
+                assert a.name == 'test_sample1'
+                p.get()
+                assert mocked_get.call_count == 3
+
+    def test_get_revalidate(self):
+        lims = Lims(url, username='test', password='password', revalidate=True)
+        a = Artifact(lims, id='a1')
+        headers = {'ETag': '"v1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        with patch('requests.Session.get',
+                   return_value=Mock(content=self.artifact_xml, status_code=200, headers=headers)):
+            a.get()
+        root = a.root
+        with patch('requests.Session.get', return_value=Mock(content='', status_code=304, headers={})) as mocked_get:
+            a.get(force=True)
+            assert mocked_get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+            assert mocked_get.call_args[1]['headers']['If-Modified-Since'] == 'Wed, 21 Oct 2015 07:28:00 GMT'
+        assert a.root is root
+
+
+class TestEntityDirty(TestEntities):
+    artifact_xml = generic_artifact_xml.format(url=url)
+
+    def test_put(self):
+        a = Artifact(self.lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=self.artifact_xml, status_code=200)), \
+                patch('requests.Session.put', return_value=Mock(content=self.artifact_xml, status_code=200)) as mocked_put:
+            a.name = 'test_sample1'
+            a.udf['Ave. Conc. (ng/uL)'] = 1
+            assert not a.is_dirty()
+            a.put()
+            assert mocked_put.call_count == 0
+
+            a.udf['Ave. Conc. (ng/uL)'] = 3
+            assert a.is_dirty()
+            a.put()
+            assert mocked_put.call_count == 1
+            assert not a.is_dirty()
+            a.put()
+            assert mocked_put.call_count == 1
+            a.put(force=True)
+            assert mocked_put.call_count == 2
+
+    def test_put_root_edited(self):
+        a = Artifact(self.lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=self.artifact_xml, status_code=200)), \
+                patch('requests.Session.put', return_value=Mock(content=self.artifact_xml, status_code=200)) as mocked_put:
+            a.get()
+            a.root.find('name').text = 'x'
+            with patch('pyclarity_lims.lims.logger') as mocked_logger:
+                assert a.put() is None
+            assert mocked_put.call_count == 0
+            assert 'use force=True' in mocked_logger.debug.call_args[0][0]
+            assert a.put(force=True) is not None
+            assert mocked_put.call_count == 1
+
+    def test_udf_cached(self):
+        a = Artifact(self.lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=self.artifact_xml, status_code=200)):
+            udf = a.udf
+            assert a.udf is udf
+            udf['Ave. Conc. (ng/uL)'] = 3
+            assert a.udf['Ave. Conc. (ng/uL)'] == 3
+            a.get(force=True)
+            assert a.udf is udf
+            assert udf['Ave. Conc. (ng/uL)'] == 1
+
+    def test_udf_held_across_refresh(self):
+        lims = Lims(url, username='test', password='password', ttl={Artifact: 60})
+        a = Artifact(lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=self.artifact_xml, status_code=200)) as mocked_get, \
+                patch('requests.Session.put', return_value=Mock(content=self.artifact_xml, status_code=200)) as mocked_put:
+            udf = a.udf
+            with patch('pyclarity_lims.entities.time.time', return_value=a._retrieved_at + 61):
+                # Reading another attribute retrieves the expired XML
+                a.name
+                assert mocked_get.call_count == 2
+                udf['Ave. Conc. (ng/uL)'] = 5
+                assert a.udf['Ave. Conc. (ng/uL)'] == 5
+                a.put()
+        sent = ElementTree.fromstring(mocked_put.call_args[1]['data'])
+        assert [f.text for f in sent.findall(nsmap('udf:field')) if f.attrib['name'] == 'Ave. Conc. (ng/uL)'] == ['5']
+
+    def test_dirty_not_stale(self):
+        lims = Lims(url, username='test', password='password', ttl={Artifact: 60})
+        a = Artifact(lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=self.artifact_xml, status_code=200)) as mocked_get:
+            a.name = 'new name'
+            with patch('pyclarity_lims.entities.time.time', return_value=a._retrieved_at + 61):
+                assert a.name == 'new name'
+                assert mocked_get.call_count == 1
@@ -1,8 +1,11 @@
-from unittest import TestCase
+from io import BytesIO
+from unittest import TestCase, skipIf
 
 from requests.exceptions import HTTPError
 
-from pyclarity_lims.lims import Lims
+from pyclarity_lims.entities import Artifact, Container, Entity, Project, Sample
+from pyclarity_lims.lims import Lims, BatchError, lxml_etree
+from tests import streamed_response
 try:
     callable(1)
 except NameError: # callable() doesn't exist in Python 3.0 and 3.1
@@ -65,29 +68,53 @@ class TestLims(TestCase):
         mocked_instance.assert_called_with('http://testgenologics.com:4040/api/v2/artifacts?sample_name=test_sample', timeout=16,
                                   headers={'accept': 'application/xml'}, params={}, auth=('test', 'password'))
 
+    def test_get_conditional(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
+        validators = {}
+        response = Mock(content=self.sample_xml, status_code=200, headers={'ETag': '"v1"'})
+        with patch('requests.Session.get', return_value=response) as mocked_get:
+            assert lims.get(uri, validators=validators) is not None
+            assert validators == {'ETag': '"v1"'}
+            assert 'If-None-Match' not in mocked_get.call_args[1]['headers']
+        with patch('requests.Session.get', return_value=Mock(content='', status_code=304, headers={})) as mocked_get:
+            assert lims.get(uri, validators=validators) is None
+            assert mocked_get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+            assert validators == {'ETag': '"v1"'}
+
+    def test_request_session(self):
+        lims = Lims(self.url, username=self.username, password=self.password, pool_maxsize=5)
+        assert lims.request_session.get_adapter('https://testgenologics.com') is lims.adapter
+        assert lims.request_session.get_adapter('http://testgenologics.com') is lims.adapter
+        assert lims.adapter._pool_maxsize == 5
+        with patch('requests.Session.put', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_put:
+            lims.put(uri=self.url + '/api/v2/samples/test_sample', data=self.sample_xml)
+            assert mocked_put.call_args[1]['auth'] == (self.username, self.password)
+
     def test_put(self):
         lims = Lims(self.url, username=self.username, password=self.password)
         uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
-        with patch('requests.put', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
+        with patch('requests.Session.put', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
             response = lims.put(uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
-        with patch('requests.put', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
+        with patch('requests.Session.put', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
             self.assertRaises(HTTPError, lims.put, uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
 
     def test_post(self):
         lims = Lims(self.url, username=self.username, password=self.password)
         uri = '{url}/api/v2/samples'.format(url=self.url)
-        with patch('requests.post', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
+        with patch('requests.Session.post', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
             response = lims.post(uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
-        with patch('requests.post', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
+        with patch('requests.Session.post', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
             self.assertRaises(HTTPError, lims.post, uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
 
+    @patch('os.path.getsize', return_value=4)
     @patch('os.path.isfile', return_value=True)
     @patch.object(builtins, 'open')
-    def test_upload_new_file(self, mocked_open, mocked_isfile):
+    def test_upload_new_file(self, mocked_open, mocked_isfile, mocked_getsize):
         lims = Lims(self.url, username=self.username, password=self.password)
         xml_intro = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>"""
         file_start = """<file:file xmlns:file="http://pyclarity_lims.com/ri/file">"""
@@ -98,7 +125,7 @@ class TestLims(TestCase):
         file_end = """</file:file>"""
         glsstorage_xml = '\n'.join([xml_intro,file_start, attached, upload, content_loc, file_end]).format(url=self.url)
         file_post_xml = '\n'.join([xml_intro, file_start2, attached, upload, content_loc, file_end]).format(url=self.url)
-        with patch('requests.post', side_effect=[Mock(content=glsstorage_xml, status_code=200),
+        with patch('requests.Session.post', side_effect=[Mock(content=glsstorage_xml, status_code=200),
                                                  Mock(content=file_post_xml, status_code=200),
                                                  Mock(content="", status_code=200)]):
 
@@ -106,20 +133,555 @@ class TestLims(TestCase):
                                         'filename_to_upload')
             assert file.id == "40-3501"
 
-        with patch('requests.post', side_effect=[Mock(content=self.error_xml, status_code=400)]):
+        with patch('requests.Session.post', side_effect=[Mock(content=glsstorage_xml, status_code=200),
+                                                 Mock(content=file_post_xml, status_code=200),
+                                                 Mock(content="", status_code=200)]) as mocked_post:
+            lims.upload_new_file(Mock(uri=self.url+"/api/v2/samples/test_sample"),
+                                 'filename_to_upload', filename='report.csv')
+            assert b'<original-location>report.csv</original-location>' in mocked_post.call_args_list[0][1]['data']
+
+        with patch('requests.Session.post', side_effect=[Mock(content=self.error_xml, status_code=400)]):
 
           self.assertRaises(HTTPError,
                             lims.upload_new_file,
                             Mock(uri=self.url+"/api/v2/samples/test_sample"),
                             'filename_to_upload')
 
-    @patch('requests.post', return_value=Mock(content = sample_xml, status_code=200))
+    def _upload_responses(self, uploaded):
+        file_xml = '<file:file xmlns:file="http://genologics.com/ri/file" uri="%s/api/v2/files/40-3501" ' \
+                   'limsid="40-3501"><original-location>report.csv</original-location></file:file>' % self.url
+
+        def post(uri, data=None, headers=None, **kwargs):
+            if uri.endswith('/upload'):
+                uploaded.append((headers['content-type'], getattr(data, 'len'), b''.join(data)))
+            return Mock(content=file_xml, status_code=200)
+        return post
+
+    def test_upload_new_file_streamed(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        entity = Mock(uri=self.url + "/api/v2/samples/test_sample")
+        uploaded = []
+        progress = []
+        with patch('requests.Session.post', side_effect=self._upload_responses(uploaded)) as mocked_post:
+            buffer = BytesIO(b'skipped,a,b\n1,2\n')
+            buffer.seek(8)
+            file = lims.upload_new_file(entity, buffer, filename='report.csv', chunk_size=4,
+                                        progress=lambda *args: progress.append(args))
+            assert file.id == '40-3501'
+            assert mocked_post.call_args[0][0] == self.url + '/api/v2/files/40-3501/upload'
+            lims.upload_new_file(entity, (line for line in [b'a,b\n', b'1,2\n']), filename='report.csv')
+            lims.upload_new_file(entity, b'a,b\n1,2\n', filename='report.csv')
+        assert progress == [(4, 8), (8, 8)]
+        for content_type, size, body in uploaded:
+            boundary = content_type.split('boundary=')[1].encode('ascii')
+            assert body.startswith(b'--' + boundary + b'\r\n')
+            assert b'filename="report.csv"' in body
+            assert body.endswith(b'\r\n\r\na,b\n1,2\n\r\n--' + boundary + b'--\r\n')
+            assert size in (len(body), None)
+        # The size of the iterator is not known so it is sent with chunked transfer encoding
+        assert [size is None for content_type, size, body in uploaded] == [False, True, False]
+        self.assertRaises(ValueError, lims.upload_new_file, entity, b'a,b\n')
+
+    @patch('requests.Session.post', return_value=Mock(content = sample_xml, status_code=200))
     def test_route_artifact(self, mocked_post):
         lims = Lims(self.url, username=self.username, password=self.password)
         artifact = Mock(uri=self.url+"/artifact/2")
         lims.route_artifacts(artifact_list=[artifact], workflow_uri=self.url+'/api/v2/configuration/workflows/1')
         assert mocked_post.call_count == 1
 
+    @staticmethod
+    def _batch_retrieve_response(uri, data, **kwargs):
+        from xml.etree import ElementTree
+        links = ElementTree.fromstring(data)
+        artifacts = []
+        for link in links:
+            limsid = link.attrib['uri'].split('/')[-1]
+            if limsid == 'fail':
+                return Mock(content=TestLims.error_xml, status_code=400)
+            artifacts.append('<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s" limsid="%s">'
+                             '<name>%s</name></art:artifact>' % (link.attrib['uri'], limsid, limsid))
+        content = '<art:details xmlns:art="http://genologics.com/ri/artifact">%s</art:details>' % ''.join(artifacts)
+        return streamed_response(content)
+
+    def test_get_batch(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(5)]
+        with patch('requests.Session.post', side_effect=self._batch_retrieve_response) as mocked_post:
+            assert lims.get_batch(artifacts + artifacts[:1]) == artifacts
+            assert mocked_post.call_count == 3
+            assert [a.name for a in artifacts] == ['a0', 'a1', 'a2', 'a3', 'a4']
+            # Everything is already loaded
+            lims.get_batch(artifacts)
+            assert mocked_post.call_count == 3
+
+    def test_get_batch_streamed(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(3)]
+        content = self._batch_retrieve_response(None, lims._links_xml(Artifact, artifacts)).raw.read()
+
+        read = []
+
+        class Raw(BytesIO):
+            def read(self, *args, **kwargs):
+                data = BytesIO.read(self, *args, **kwargs)
+                read.append(len(data))
+                return data
+
+        with patch('pyclarity_lims.lims.CHUNK_SIZE', 16):
+            # The elements are yielded before the end of the response is read
+            nodes = lims._iter_children(streamed_response(content, raw=Raw(content)))
+            assert next(nodes).attrib['limsid'] == 'a0'
+            assert sum(read) < len(content)
+            assert [node.attrib['limsid'] for node in nodes] == ['a1', 'a2']
+        with patch('requests.Session.post', return_value=streamed_response(content)) as mocked:
+            lims.get_batch(artifacts)
+        assert mocked.call_args[1]['stream'] is True
+        assert [a.name for a in artifacts] == ['a0', 'a1', 'a2']
+        assert [len(a.root) for a in artifacts] == [1, 1, 1]
+
+    def test_get_batch_loads_in_calling_thread(self):
+        import threading
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=1, max_workers=4)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(4)]
+        projects = [Project(lims, id='p%s' % i) for i in range(4)]
+        threads = set()
+        set_root = Entity.root.fset
+
+        def record(instance, value):
+            threads.add(threading.current_thread())
+            set_root(instance, value)
+
+        with patch.object(Entity, 'root', Entity.root.setter(record)), \
+                patch('requests.Session.post', side_effect=self._batch_retrieve_response), \
+                patch('requests.Session.get', side_effect=self._related_get_response):
+            lims.get_batch(artifacts + projects)
+        assert [a.name for a in artifacts] == ['a0', 'a1', 'a2', 'a3']
+        assert [p.name for p in projects] == ['p1'] * 4
+        assert threads == set([threading.current_thread()])
+
+    @skipIf(lxml_etree is None, 'lxml is not installed')
+    def test_get_batch_streamed_lxml(self):
+        lims = Lims(self.url, username=self.username, password=self.password, xml_backend='lxml')
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(3)]
+        with patch('requests.Session.post', side_effect=self._batch_retrieve_response):
+            lims.get_batch(artifacts)
+        assert [a.name for a in artifacts] == ['a0', 'a1', 'a2']
+        assert all(lxml_etree.iselement(a.root) for a in artifacts)
+
+    def test_get_batch_partial_failure(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        artifacts = [Artifact(lims, id=i) for i in ('a1', 'a2', 'fail', 'a3')]
+        with patch('requests.Session.post', side_effect=self._batch_retrieve_response):
+            with self.assertRaises(BatchError) as context:
+                lims.get_batch(artifacts)
+        assert len(context.exception.errors) == 1
+        assert context.exception.errors[0][0] == artifacts[2:]
+        assert isinstance(context.exception.errors[0][1], HTTPError)
+        assert [a.root is not None for a in artifacts] == [True, True, False, False]
+
+    @staticmethod
+    def _batch_update_response(uri, data, **kwargs):
+        from xml.etree import ElementTree
+        details = ElementTree.fromstring(data)
+        for artifact in details:
+            if artifact.attrib['limsid'] == 'fail':
+                return Mock(content=TestLims.error_xml, status_code=400)
+            artifact.find('name').text += ' updated'
+        return Mock(content=ElementTree.tostring(details), status_code=200)
+
+    def test_prefetch_related(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(2)]
+        with patch('requests.Session.post', side_effect=self._related_batch_response) as mocked_post, \
+                patch('requests.Session.get', side_effect=self._related_get_response) as mocked_get:
+            assert lims.prefetch_related(artifacts, ['samples', 'samples.project', 'container']) == artifacts
+            # One batch per class of artifacts, samples and containers and one GET for the only project
+            assert mocked_post.call_count == 3
+            assert mocked_get.call_count == 1
+            assert [a.samples[0].project.name for a in artifacts] == ['p1', 'p1']
+            assert [a.container.name for a in artifacts] == ['c1', 'c1']
+            assert mocked_post.call_count == 3
+            assert mocked_get.call_count == 1
+
+    def _related_batch_response(self, uri, data, **kwargs):
+        from xml.etree import ElementTree
+        nodes = []
+        for link in ElementTree.fromstring(data):
+            limsid = link.attrib['uri'].split('/')[-1]
+            if limsid.startswith('a'):
+                nodes.append('<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="{uri}" limsid="{id}">'
+                             '<location><container uri="{url}/api/v2/containers/c1"/><value>A:1</value></location>'
+                             '<sample uri="{url}/api/v2/samples/s{id}"/></art:artifact>')
+            elif limsid.startswith('s'):
+                nodes.append('<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{uri}" limsid="{id}">'
+                             '<project uri="{url}/api/v2/projects/p1"/></smp:sample>')
+            else:
+                nodes.append('<con:container xmlns:con="http://genologics.com/ri/container" uri="{uri}" '
+                             'limsid="{id}"><name>{id}</name></con:container>')
+            nodes[-1] = nodes[-1].format(uri=link.attrib['uri'], id=limsid, url=self.url)
+        content = '<ri:details xmlns:ri="http://genologics.com/ri">%s</ri:details>' % ''.join(nodes)
+        return streamed_response(content)
+
+    def _related_get_response(self, uri, **kwargs):
+        content = '<prj:project xmlns:prj="http://genologics.com/ri/project" uri="%s" limsid="p1">' \
+                  '<name>p1</name></prj:project>' % uri
+        return Mock(content=content, status_code=200, headers={})
+
+    def test_get_projects_resolve(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+
+        def fake_get(uri, **kwargs):
+            if uri.endswith('/projects'):
+                content = '<prj:projects xmlns:prj="http://genologics.com/ri/project">%s</prj:projects>' % ''.join(
+                    '<project uri="%s/api/v2/projects/p%s" limsid="p%s"/>' % (self.url, i, i) for i in range(5)
+                )
+            else:
+                content = '<prj:project xmlns:prj="http://genologics.com/ri/project" uri="%s" limsid="%s">' \
+                          '<name>%s</name></prj:project>' % (uri, uri.split('/')[-1], uri.split('/')[-1])
+            return Mock(content=content, status_code=200, headers={})
+
+        # Projects have no batch endpoint so they are retrieved one by one on a thread pool
+        with patch('requests.Session.get', side_effect=fake_get) as mocked_get, \
+                patch('requests.Session.post') as mocked_post:
+            projects = lims.get_projects(resolve=True)
+            assert [p.name for p in projects] == ['p0', 'p1', 'p2', 'p3', 'p4']
+            assert mocked_get.call_count == 6
+            assert mocked_post.call_count == 0
+
+    def test_get_samples_resolve(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        with patch('requests.Session.get', side_effect=self._sample_pages(2)) as mocked_get, \
+                patch('requests.Session.post', side_effect=self._related_batch_response) as mocked_post:
+            samples = lims.get_samples(resolve=True)
+            assert len(samples) == 4
+            assert all(s.root is not None for s in samples)
+            assert mocked_get.call_count == 2
+            assert mocked_post.call_count == 1
+
+    def test_batching_thread(self):
+        import threading
+        lims = Lims(self.url, username=self.username, password=self.password)
+        with patch('requests.Session.post', side_effect=self._batch_retrieve_response) as mocked_post:
+            with lims.batching():
+                a1 = Artifact(lims, id='a1')
+                in_thread = []
+
+                def create():
+                    in_thread.append(lims.is_batching())
+                    in_thread.append(Artifact(lims, id='a2'))
+
+                thread = threading.Thread(target=create)
+                thread.start()
+                thread.join()
+                # The instance created by the other thread is not retrieved with the batch of this one
+                assert a1.name == 'a1'
+                assert mocked_post.call_count == 1
+                assert in_thread[0] is False
+                assert in_thread[1].root is None
+
+    def test_batching(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        with patch('requests.Session.post', side_effect=self._batch_retrieve_response) as mocked_post:
+            with lims.batching():
+                artifacts = [Artifact(lims, id=i) for i in ('a1', 'a2', 'fail', 'a3')]
+                # The chunk with the failing artifact is not loaded but does not prevent accessing a1
+                assert artifacts[0].name == 'a1'
+                assert mocked_post.call_count == 2
+                assert artifacts[1].root is not None
+                assert artifacts[3].root is None
+                # a3 is retrieved with the next batch request
+                assert artifacts[3].name == 'a3'
+                assert mocked_post.call_count == 3
+            assert not lims.is_batching()
+            assert not lims._pending
+
+            # Outside of the scope, the instances are retrieved one by one
+            artifact = Artifact(lims, id='a4')
+            with patch('requests.Session.get', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_get:
+                artifact.get()
+                assert mocked_get.call_count == 1
+            assert mocked_post.call_count == 3
+
+    def test_put_batch(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        artifacts = [Artifact(lims, id=i) for i in ('a1', 'a2', 'fail', 'a3', 'a4')]
+        from xml.etree import ElementTree
+        for a in artifacts:
+            a.root = ElementTree.fromstring(
+                '<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s" limsid="%s">'
+                '<name>%s</name></art:artifact>' % (a.uri, a.id, a.id)
+            )
+            a.mark_dirty()
+        with patch('requests.Session.post', side_effect=self._batch_update_response) as mocked_post:
+            with self.assertRaises(BatchError) as context:
+                lims.put_batch(artifacts)
+            assert mocked_post.call_count == 3
+        assert context.exception.errors[0][0] == artifacts[2:4]
+        assert [a.name for a in artifacts] == ['a1 updated', 'a2 updated', 'fail', 'a3', 'a4 updated']
+        assert [a.is_dirty() for a in artifacts] == [False, False, True, True, False]
+
+    def test_session(self):
+        from xml.etree import ElementTree
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        artifacts = [Artifact(lims, id=i) for i in ('a1', 'fail', 'a2', 'a3')]
+        projects = [Project(lims, id=i) for i in ('p1', 'p2')]
+        for a in artifacts:
+            a.root = ElementTree.fromstring(
+                '<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s" limsid="%s">'
+                '<name>%s</name></art:artifact>' % (a.uri, a.id, a.id)
+            )
+        for p in projects:
+            p.root = ElementTree.fromstring(
+                '<prj:project xmlns:prj="http://genologics.com/ri/project" uri="%s" limsid="%s">'
+                '<name>%s</name></prj:project>' % (p.uri, p.id, p.id)
+            )
+        with patch('requests.Session.post', side_effect=self._batch_update_response) as mocked_post, \
+                patch('requests.Session.put', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_put:
+            with self.assertRaises(BatchError) as context:
+                with lims.session():
+                    for a in artifacts[:3]:
+                        a.name = a.id
+                        a.name = a.id + ' new'
+                    with lims.session():
+                        projects[1].name = 'p2 new'
+                    # Nothing is saved before the outermost session exits
+                    assert mocked_post.call_count == 0
+                    assert mocked_put.call_count == 0
+            # a3 was not modified, the second chunk only contains a2
+            assert mocked_post.call_count == 2
+            assert mocked_put.call_count == 1
+            assert mocked_put.call_args[0][0] == projects[1].uri
+        assert context.exception.errors[0][0] == artifacts[:2]
+        assert [a.name for a in artifacts] == ['a1 new', 'fail new', 'a2 new updated', 'a3']
+        assert [a.is_dirty() for a in artifacts + projects] == [True, True, False, False, False, False]
+        assert not lims._modified
+
+        # Nothing is saved when the scope raises
+        with patch('requests.Session.post', side_effect=self._batch_update_response) as mocked_post:
+            with self.assertRaises(ValueError):
+                with lims.session():
+                    artifacts[3].name = 'a3 new'
+                    raise ValueError()
+            assert mocked_post.call_count == 0
+        assert artifacts[3].is_dirty()
+        assert not lims._modified
+
+    def test_session_thread(self):
+        import threading
+        from xml.etree import ElementTree
+        lims = Lims(self.url, username=self.username, password=self.password)
+        projects = [Project(lims, id='p%s' % i) for i in range(2)]
+        for p in projects:
+            p.root = ElementTree.fromstring(
+                '<prj:project xmlns:prj="http://genologics.com/ri/project" uri="%s" limsid="%s">'
+                '<name>%s</name></prj:project>' % (p.uri, p.id, p.id)
+            )
+
+        def modify():
+            projects[1].name = 'p1 new'
+
+        with patch('requests.Session.put', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_put:
+            with lims.session():
+                projects[0].name = 'p0 new'
+                # The modifications made by another thread are not saved by this session
+                thread = threading.Thread(target=modify)
+                thread.start()
+                thread.join()
+            assert mocked_put.call_count == 1
+            assert mocked_put.call_args[0][0] == projects[0].uri
+        assert projects[1].is_dirty()
+
+    def test_xml_backend(self):
+        with self.assertRaises(ValueError):
+            Lims(self.url, username=self.username, password=self.password, xml_backend='sax')
+        with patch('pyclarity_lims.lims.lxml_etree', None):
+            with self.assertRaises(ImportError):
+                Lims(self.url, username=self.username, password=self.password, xml_backend='lxml')
+
+    @skipIf(lxml_etree is None, 'lxml is not installed')
+    def test_lxml_backend(self):
+        from xml.etree import ElementTree
+        lims = Lims(self.url, username=self.username, password=self.password, xml_backend='lxml')
+        root = lims.parse_response(Mock(content=self.sample_xml, status_code=200))
+        assert lxml_etree.iselement(root)
+        with self.assertRaises(ElementTree.ParseError):
+            lims.fromstring('<unclosed>')
+        with self.assertRaises(HTTPError) as context:
+            lims.parse_response(Mock(content=self.error_xml, status_code=400))
+        assert str(context.exception) == '400: Generic error message'
+
+        artifacts = [Artifact(lims, id=i) for i in ('a1', 'a2')]
+        with patch('requests.Session.post', side_effect=self._batch_retrieve_response):
+            lims.get_batch(artifacts)
+        assert lxml_etree.iselement(artifacts[0].root)
+        artifacts[0].name = 'a1 new'
+        artifacts[1].name = 'a2 new'
+        with patch('requests.Session.put', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_put:
+            artifacts[0].put()
+        sent = ElementTree.fromstring(mocked_put.call_args[1]['data'])
+        assert sent.find('name').text == 'a1 new'
+        with patch('requests.Session.post', side_effect=self._batch_update_response) as mocked_post:
+            lims.put_batch(artifacts, force=True)
+        assert [a.name for a in artifacts] == ['a1 new updated', 'a2 new updated']
+        # Entities created locally use ElementTree and are serialized with it
+        container = Container._create(lims, name='c1')
+        assert b'<name>c1</name>' in lims.tostring(ElementTree.ElementTree(container.root))
+
+    def test_put_batch_skip_clean(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifacts = [Artifact(lims, id=i) for i in ('a1', 'a2', 'a3')]
+        from xml.etree import ElementTree
+        for a in artifacts:
+            a.root = ElementTree.fromstring(
+                '<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s" limsid="%s">'
+                '<name>%s</name></art:artifact>' % (a.uri, a.id, a.id)
+            )
+        # Setting the same value does not modify the artifact
+        artifacts[0].name = 'a1'
+        artifacts[1].name = 'a2 renamed'
+        with patch('requests.Session.post', side_effect=self._batch_update_response) as mocked_post:
+            lims.put_batch(artifacts)
+            assert mocked_post.call_count == 1
+            assert b'a2 renamed' in mocked_post.call_args[1]['data']
+            assert b'a1' not in mocked_post.call_args[1]['data']
+            lims.put_batch(artifacts)
+            assert mocked_post.call_count == 1
+            lims.put_batch(artifacts, force=True)
+            assert mocked_post.call_count == 2
+
+    def test_create_batch(self):
+        from xml.etree import ElementTree
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        container = Container(lims, id='c1')
+        sent = []
+
+        def post(uri, data, **kwargs):
+            if uri.endswith('batch/create'):
+                details = ElementTree.fromstring(data)
+                sent.append(details)
+                links = ''.join('<link uri="%s/api/v2/samples/%s" rel="samples"/>' % (self.url, s.find('name').text)
+                                for s in details)
+                return Mock(content='<ri:links xmlns:ri="http://genologics.com/ri">%s</ri:links>' % links,
+                            status_code=201)
+            links = ElementTree.fromstring(data)
+            samples = ''.join('<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="%s" limsid="%s">'
+                              '<name>%s</name></smp:sample>' % (l.attrib['uri'], l.attrib['uri'][-2:], l.attrib['uri'][-2:])
+                              for l in links)
+            return streamed_response(
+                '<smp:details xmlns:smp="http://genologics.com/ri/sample">%s</smp:details>' % samples
+            )
+
+        with patch('requests.Session.post', side_effect=post) as mocked_post:
+            samples = lims.create_batch(Sample, [dict(container=container, position='%s:1' % p, name='s%s' % p)
+                                                 for p in 'ABC'])
+            assert mocked_post.call_count == 4
+        assert [s.id for s in samples] == ['sA', 'sB', 'sC']
+        assert [s.name for s in samples] == ['sA', 'sB', 'sC']
+        assert Sample(lims, id='sB') is samples[1]
+        assert sent[0].tag == '{http://genologics.com/ri/sample}details'
+        assert [s.find('location/value').text for s in sent[0]] == ['A:1', 'B:1']
+
+    def test_create_batch_partial_failure(self):
+        from xml.etree import ElementTree
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=1)
+        container = Container(lims, id='c1')
+
+        def post(uri, data, **kwargs):
+            if uri.endswith('batch/create'):
+                names = [s.find('name').text for s in ElementTree.fromstring(data)]
+                if 'sF' in names:
+                    return Mock(content=self.error_xml, status_code=400)
+                links = ''.join('<link uri="%s/api/v2/samples/%s" rel="samples"/>' % (self.url, n) for n in names)
+                return Mock(content='<ri:links xmlns:ri="http://genologics.com/ri">%s</ri:links>' % links,
+                            status_code=201)
+            uris = [l.attrib['uri'] for l in ElementTree.fromstring(data)]
+            if any(u.endswith('sR') for u in uris):
+                return Mock(content=self.error_xml, status_code=400)
+            return streamed_response(
+                '<smp:details xmlns:smp="http://genologics.com/ri/sample">%s</smp:details>' % ''.join(
+                    '<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="%s" limsid="%s"><name>%s</name>'
+                    '</smp:sample>' % (u, u[-2:], u[-2:]) for u in uris)
+            )
+
+        with patch('requests.Session.post', side_effect=post):
+            with self.assertRaises(BatchError) as context:
+                lims.create_batch(Sample, [dict(container=container, position='%s:1' % p, name='s%s' % p)
+                                           for p in 'AFR'])
+        error = context.exception
+        # The sample that failed to be created and the one created but not retrieved are both reported
+        assert [chunk[0].name for chunk, e in error.errors] == ['sF']
+        assert [s.id for s in error.created] == ['sA', 'sR']
+        assert [[s.id for s in chunk] for chunk, e in error.retrieve_errors] == [['sR']]
+        assert error.created[0].name == 'sA'
+        assert error.created[1].root is None
+
+    def _sample_pages(self, nb_pages, page_size=2, nb_samples=None):
+        """Return a function mocking Session.get for a list of samples spread over nb_pages pages."""
+        if nb_samples is None:
+            nb_samples = nb_pages * page_size
+
+        def get(uri, params=None, **kwargs):
+            params = params or {}
+            start = int(uri.split('start-index=')[1]) if 'start-index=' in uri else int(params.get('start-index', 0))
+            page = start // page_size
+            samples = ''.join('<sample uri="%s/api/v2/samples/s%s" limsid="s%s"/>' % (self.url, i, i)
+                              for i in range(start, min(start + page_size, nb_samples)))
+            next_page = ''
+            if page < nb_pages - 1:
+                next_page = '<next-page uri="%s/api/v2/samples?start-index=%s"/>' % (self.url, start + page_size)
+            content = '<smp:samples xmlns:smp="http://genologics.com/ri/sample">%s%s</smp:samples>' % (samples, next_page)
+            return Mock(content=content, status_code=200)
+        return get
+
+    def test_iter_samples(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        with patch('requests.Session.get', side_effect=self._sample_pages(3)) as mocked_get:
+            samples = lims.iter_samples(name='s1')
+            assert mocked_get.call_count == 0
+            assert next(samples).id == 's0'
+            assert mocked_get.call_count == 1
+            assert [s.id for s in samples] == ['s1', 's2', 's3', 's4', 's5']
+            assert mocked_get.call_count == 3
+            assert mocked_get.call_args_list[0][1]['params'] == {'name': 's1'}
+
+        with patch('requests.Session.get', side_effect=self._sample_pages(3)) as mocked_get:
+            samples = lims.iter_samples(prefetch_pages=True)
+            assert [s.id for s in samples] == ['s0', 's1', 's2', 's3', 's4', 's5']
+            assert mocked_get.call_count == 3
+            assert lims.get_samples() == [Sample(lims, id='s%s' % i) for i in range(6)]
+
+    def test_iter_pages_prefetch(self):
+        lims = Lims(self.url, username=self.username, password=self.password, prefetch_pages=3)
+        with patch('requests.Session.get', side_effect=self._sample_pages(5)) as mocked_get:
+            assert lims.get_samples(name='s1') == [Sample(lims, id='s%s' % i) for i in range(10)]
+            # pages after the first one are requested by start-index with the original parameters
+            params = [c[1]['params'] for c in mocked_get.call_args_list[1:]]
+            for p in params:
+                assert p['name'] == 's1'
+            assert sorted(p['start-index'] for p in params)[:4] == [2, 4, 6, 8]
+
+        with patch('requests.Session.get', side_effect=self._sample_pages(1)) as mocked_get:
+            assert lims.get_samples() == [Sample(lims, id='s0'), Sample(lims, id='s1')]
+            assert mocked_get.call_count == 1
+
+        # the window starts with one request so that short queries do not request pages past the end
+        with patch('requests.Session.get', side_effect=self._sample_pages(2, page_size=10, nb_samples=11)) as mocked_get:
+            assert len(list(lims.iter_samples(prefetch_pages=8))) == 11
+            assert mocked_get.call_count == 2
+
+    def test_get_sample_number(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        for nb_pages, nb_samples in ((1, 1), (2, 4), (3, 5), (7, 13), (20, 40)):
+            with patch('requests.Session.get', side_effect=self._sample_pages(nb_pages, nb_samples=nb_samples)) as mocked_get:
+                assert lims.get_sample_number(name='s1') == nb_samples
+                assert mocked_get.call_count <= 2 * nb_pages.bit_length() + 1
+                for c in mocked_get.call_args_list:
+                    assert c[1]['params']['name'] == 's1'
+
+        with patch('requests.Session.get', side_effect=self._sample_pages(3)) as mocked_get:
+            assert lims.get_sample_number(start_index=4) == 2
+            assert mocked_get.call_count == 1
+
     def test_tostring(self):
         lims = Lims(self.url, username=self.username, password=self.password)
         from xml.etree import ElementTree as ET
@@ -146,3 +708,36 @@ class TestLims(TestCase):
         assert lims.get_file_contents(id='an_id', encoding='utf-16', crlf=True) == 'some data\n'
         assert lims.request_session.get.return_value.encoding == 'utf-16'
         lims.request_session.get.assert_called_with(exp_url, auth=(self.username, self.password), timeout=16)
+
+    def test_iter_file_contents(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        content = u'\u00e9t\u00e9\r\nline 2\r\n\r\nend'.encode('utf-16')
+        with patch('requests.Session.get', side_effect=lambda *args, **kwargs: streamed_response(content)) as mocked:
+            # The chunks split the characters and the \r\n
+            chunks = list(lims.iter_file_contents(id='an_id', encoding='utf-16', crlf=True, chunk_size=3))
+            assert len(chunks) > 5
+            assert ''.join(chunks) == u'\u00e9t\u00e9\nline 2\n\nend'
+            mocked.assert_called_with(self.url + '/api/v2/files/an_id/download', stream=True, timeout=16,
+                                      auth=(self.username, self.password))
+            assert list(lims.iter_file_contents(id='an_id', binary=True, chunk_size=4)) == \
+                [content[i:i + 4] for i in range(0, len(content), 4)]
+            assert list(lims.iter_file_lines(id='an_id', encoding='utf-16', chunk_size=5)) == \
+                [u'\u00e9t\u00e9\r\n', u'line 2\r\n', u'\r\n', u'end']
+
+    def test_download_file(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        content = u'\u00e9t\u00e9\r\nline 2\r\n'.encode('latin-1')
+        with patch('requests.Session.get', side_effect=lambda *args, **kwargs: streamed_response(content)):
+            outfile = BytesIO()
+            assert lims.download_file(outfile, id='an_id', chunk_size=3) == len(content)
+            assert outfile.getvalue() == content
+            outfile = BytesIO()
+            lims.download_file(outfile, id='an_id', encoding='latin-1', crlf=True, output_encoding='utf-8', chunk_size=3)
+            assert outfile.getvalue() == u'\u00e9t\u00e9\nline 2\n'.encode('utf-8')
+            with patch.object(builtins, 'open', return_value=Mock()) as mocked_open:
+                lims.download_file('/path/to/file', uri=self.url + '/api/v2/files/an_id', chunk_size=100)
+            mocked_open.assert_called_with('/path/to/file', 'wb')
+            mocked_open.return_value.write.assert_called_once_with(content)
+            mocked_open.return_value.close.assert_called_once_with()
+        with patch('requests.Session.get', return_value=streamed_response(self.error_xml, status_code=400)):
+            self.assertRaises(HTTPError, lims.download_file, BytesIO(), id='an_id')